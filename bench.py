@@ -0,0 +1,276 @@
+# bench.py — воспроизводимый бенчмарк горячих путей бота на локальных заглушках
+#
+#   python bench.py                                  # все сценарии
+#   python bench.py fetch_warm commands --pools 8000
+#   python bench.py --json run1.json                 # сохранить результат
+#   python bench.py --compare run1.json              # сравнить с прошлым прогоном
+#
+# Поднимает fake_curve.py и fake_telegram.py отдельными процессами (чтобы
+# заглушки не делили CPU с ботом) и гоняет сценарии:
+#   fetch_cold — fetch_chain_snapshot с пустыми кэшами источников
+#   fetch_warm — то же с прогретыми ETag/хэшами (как при обычном опросе)
+#   format     — format_chain_table по всем сетям и ключам, без кэша вывода
+#   commands   — полный путь команды: getUpdates → updates_loop → sendMessage
+#   webhook    — то же, но апдейты приходят POST'ом на встроенный webhook-сервер
+#                (темп отправки и дедупликация outbox сняты, как в bench_dispatch.py
+#                и bench_roles.py, — иначе меряется лимит 25 сообщений/с, а не путь
+#                команды; --telegram-limits оставляет SEND_RATE_* / SEND_DEDUP_S)
+# Для каждого: p50/p95/p99/max, ops/s, сборки gc поколения 0 — прокси числа
+# аллокаций объектов, и отдельным проходом под tracemalloc — пик памяти и
+# blocks: сколько блоков памяти сценарий оставил живыми (разница снимков
+# tracemalloc до и после, после gc.collect()).
+
+import os, sys, gc, json, time, random, socket, asyncio, argparse, tracemalloc, subprocess
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+os.environ.setdefault("CHAT_ID", "0")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import bot as app  # noqa: E402
+
+import aiohttp  # noqa: E402
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+SCENARIOS = ("fetch_cold", "fetch_warm", "format", "commands", "webhook")
+COMMANDS = ["/ping", "/chains", "/vol 25", "/{chain} 25 {sort}", "/top {sort} all 40"]
+
+# ---------- stand-ins ----------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def _wait_up(url: str, proc, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as s:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise SystemExit(f"stand-in exited: {proc.args}")
+            try:
+                async with s.get(url) as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise SystemExit(f"stand-in not ready: {url}")
+
+async def start_stand_ins(args):
+    curve_port, tg_port = _free_port(), _free_port()
+    curve = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_curve.py"), "serve", "--port", str(curve_port),
+        "--chains", ",".join(args.chains), "--pools", str(args.pools),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate)] + (["--data", args.data] if args.data else []),
+        stdout=subprocess.DEVNULL)
+    tg = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_telegram.py"), "--port", str(tg_port),
+        "--send-ms", str(args.send_ms)], stdout=subprocess.DEVNULL)
+    await _wait_up(f"http://127.0.0.1:{curve_port}/_stats", curve)
+    await _wait_up(f"http://127.0.0.1:{tg_port}/_stats", tg)
+    return curve, tg, f"http://127.0.0.1:{curve_port}/v1", f"http://127.0.0.1:{tg_port}"
+
+def configure(args, curve_api: str, tg_base: str):
+    app.API = curve_api
+    app.CHAINS = list(args.chains)
+    app.bot = Bot(app.TOKEN, base_url=f"{tg_base}/bot",
+                  request=HTTPXRequest(connection_pool_size=app.TG_CONNECTIONS))
+    app.snapshots = app.SnapshotCache(app.SNAPSHOT_TTL, app.SNAPSHOT_MAX_STALE)   # без диска
+    app.outbox = make_outbox(args)
+    app.print = lambda *a, **kw: None
+
+def make_outbox(args):
+    if args.telegram_limits:
+        return app.Outbox(app.SEND_RATE_GLOBAL, app.SEND_RATE_CHAT, app.SEND_DEDUP_S)
+    return app.Outbox(global_rate=1e6, chat_rate=1e6, dedup_s=0)
+
+def reset_fetch_state():
+    app._sources.clear()
+    app._merge_state.clear()
+    app._breakers.clear()
+
+# ---------- scenarios ----------
+async def sc_fetch(args, warm: bool):
+    out = []
+    async with app.http_session() as session:
+        if warm:
+            for ch in args.chains:
+                await app.fetch_chain_snapshot(session, ch)
+        for _ in range(args.runs):
+            if not warm:
+                reset_fetch_state()
+            for ch in args.chains:
+                t = time.perf_counter()
+                await app.fetch_chain_snapshot(session, ch)
+                out.append(time.perf_counter() - t)
+    return out
+
+async def sc_fetch_cold(args, env):
+    return await sc_fetch(args, warm=False)
+
+async def sc_fetch_warm(args, env):
+    return await sc_fetch(args, warm=True)
+
+async def sc_format(args, env):
+    async with app.http_session() as session:
+        snaps = [await app.fetch_chain_snapshot(session, ch) for ch in args.chains]
+    out = []
+    for _ in range(args.runs):
+        for snap in snaps:
+            for sort in app.SORT_KEYS:
+                app._rendered.clear()
+                t = time.perf_counter()
+                app.format_chain_table(snap.chain, snap, 25, sort)
+                out.append(time.perf_counter() - t)
+    return out
+
+async def sc_commands(args, env, webhook: bool = False):
+    # задержка — от /_inject до последней части ответа, по часам fake_telegram
+    tg_base = env["tg"]
+    rnd = random.Random(7)
+    cmds = [rnd.choice(COMMANDS).format(chain=rnd.choice(args.chains), sort=rnd.choice(app.SORT_KEYS))
+            for _ in range(args.commands)]
+    reset_fetch_state()
+    app.snapshots = app.SnapshotCache(app.SNAPSHOT_TTL, app.SNAPSHOT_MAX_STALE)
+    app.outbox = make_outbox(args)
+    app._rendered.clear()
+    app.WEBHOOK_URL = ""
+    if webhook:
+        port = _free_port()
+        app.WEBHOOK_HOST, app.WEBHOOK_PORT, app.WEBHOOK_PATH = "127.0.0.1", port, "/tg"
+        app.WEBHOOK_URL = f"http://127.0.0.1:{port}/tg"
+    async with aiohttp.ClientSession() as s:
+        await s.post(f"{tg_base}/_reset")
+        loop_task = asyncio.create_task(app.updates_loop())
+        await asyncio.sleep(0.3)
+        while webhook:   # не мерить время до setWebhook
+            async with s.get(f"{tg_base}/bot{app.TOKEN}/getWebhookInfo") as r:
+                if (await r.json())["result"]["url"]:
+                    break
+            await asyncio.sleep(0.05)
+        # одна команда на чат: все ответы в чат — ответ на неё
+        for i, text in enumerate(cmds):
+            await s.post(f"{tg_base}/_inject", json={"chat_id": 1000 + i, "text": text})
+            await asyncio.sleep(args.burst / len(cmds))
+        deadline = time.monotonic() + args.timeout
+        while True:
+            async with s.get(f"{tg_base}/_stats") as r:
+                st = await r.json()
+            done = sum(1 for c in st["chats"].values() if c["out"])
+            if done >= len(cmds) or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(0.5)   # дождаться хвостовых частей длинных ответов
+        async with s.get(f"{tg_base}/_stats") as r:
+            st = await r.json()
+        loop_task.cancel()
+        await asyncio.gather(loop_task, return_exceptions=True)
+    lat = [c["out"][-1] - c["in"][0] for c in st["chats"].values() if c["out"]]
+    if len(lat) < len(cmds):
+        print(f"  commands: {len(cmds) - len(lat)} without reply after {args.timeout}s")
+    first = min(c["in"][0] for c in st["chats"].values())
+    last = max(c["out"][-1] for c in st["chats"].values() if c["out"])
+    return lat, len(lat) / max(last - first, 1e-9)
+
+async def sc_webhook(args, env):
+    return await sc_commands(args, env, webhook=True)
+
+# ---------- measure ----------
+def pctl(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))] * 1000 if xs else float("nan")
+
+async def measure(name, fn, args, env):
+    gc.collect()
+    gc0 = gc.get_stats()[0]["collections"]
+    t = time.perf_counter()
+    res = await fn(args, env)
+    wall = time.perf_counter() - t
+    gc0 = gc.get_stats()[0]["collections"] - gc0
+    lat, ops = res if isinstance(res, tuple) else (res, len(res) / wall)
+    peak = blocks = None
+    if args.memory:
+        tracemalloc.start()
+        before = traced_snapshot()
+        tracemalloc.reset_peak()   # без памяти самого снимка
+        await fn(args, env)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        blocks = sum(st.count_diff for st in traced_snapshot().compare_to(before, "filename"))
+        tracemalloc.stop()
+    return {"n": len(lat), "p50": pctl(lat, 50), "p95": pctl(lat, 95), "p99": pctl(lat, 99),
+            "max": max(lat) * 1000 if lat else float("nan"), "ops": ops, "peak_mib": peak,
+            "blocks": blocks, "gc0": gc0}
+
+def traced_snapshot():
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+def report(results, prev=None):
+    print(f"{'scenario':12}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'ops/s':>9}{'peak MiB':>10}{'blocks':>9}{'gc0':>7}")
+    for name, r in results.items():
+        peak = f"{r['peak_mib']:.1f}" if r["peak_mib"] is not None else "-"
+        blocks = f"{r['blocks']:+d}" if r.get("blocks") is not None else "-"
+        print(f"{name:12}{r['n']:>6}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}{r['max']:>10.1f}"
+              f"{r['ops']:>9.1f}{peak:>10}{blocks:>9}{r['gc0']:>7}")
+        p = (prev or {}).get(name)
+        if p:
+            def d(k):
+                return f"{(r[k] - p[k]) / p[k] * 100:+.0f}%" if p.get(k) and r.get(k) is not None else "-"
+            print(f"{'  vs prev':12}{'':>6}{d('p50'):>10}{d('p95'):>10}{d('p99'):>10}{d('max'):>10}"
+                  f"{d('ops'):>9}{d('peak_mib'):>10}{d('blocks'):>9}{d('gc0'):>7}")
+
+async def run(args):
+    curve, tg, curve_api, tg_base = await start_stand_ins(args)
+    try:
+        configure(args, curve_api, tg_base)
+        env = {"curve": curve_api.rsplit("/v1", 1)[0], "tg": tg_base}
+        results = {}
+        for name in args.scenarios:
+            results[name] = await measure(name, globals()[f"sc_{name}"], args, env)
+        return results
+    finally:
+        for p in (curve, tg):
+            p.terminate()
+            p.wait()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=", ".join(SCENARIOS))
+    ap.add_argument("--chains", default="ethereum,arbitrum,polygon")
+    ap.add_argument("--pools", type=int, default=4000, help="пулов на сеть в fake_curve")
+    ap.add_argument("--data", help="записанные ответы для fake_curve (fake_curve.py record)")
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--jitter-ms", type=float, default=20)
+    ap.add_argument("--error-rate", type=float, default=0)
+    ap.add_argument("--send-ms", type=float, default=20, help="задержка sendMessage в fake_telegram")
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--commands", type=int, default=200)
+    ap.add_argument("--burst", type=float, default=2.0, help="за сколько секунд приходят команды")
+    ap.add_argument("--timeout", type=float, default=60, help="ждать ответов на команды не дольше")
+    ap.add_argument("--telegram-limits", action="store_true", help="оставить SEND_RATE_* и SEND_DEDUP_S как в боте")
+    ap.add_argument("--no-memory", dest="memory", action="store_false", help="без прохода с tracemalloc")
+    ap.add_argument("--json", help="сохранить результат в файл")
+    ap.add_argument("--compare", help="сравнить с сохранённым результатом")
+    args = ap.parse_args()
+    args.chains = [c.strip() for c in args.chains.split(",") if c.strip()]
+    bad = set(args.scenarios) - set(SCENARIOS)
+    if bad:
+        ap.error(f"unknown scenarios: {', '.join(sorted(bad))}")
+
+    prev = None
+    if args.compare:
+        with open(args.compare) as fh:
+            prev = json.load(fh)["results"]
+    results = asyncio.run(run(args))
+    print(f"{len(args.chains)} chains × {args.pools} pools, api {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, "
+          f"send {args.send_ms:.0f} ms\n")
+    report(results, prev)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                       "results": results}, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# bench_dispatch.py — задержка команд под пачкой запросов: старый serial-цикл против Dispatcher
+#
+#   python bench_dispatch.py
+#   python bench_dispatch.py --commands 300 --chats 12 --burst 2 --fetch-ms 600
+#
+# Telegram подменяется FakeTelegram (getUpdates/sendMessage в памяти, с задержкой
+# отправки), Curve API — фейковым fetch_chain_snapshot с задержкой и снапшотом
+# из fake_curve.make_payloads. Задержка команды = от попадания апдейта в
+# getUpdates до отправки последней части ответа на неё (safe_send).
+#   legacy — как было: команды по одной прямо в цикле + sleep(1.5) после пачки
+#   new    — updates_loop с Dispatcher
+
+import os, sys, time, random, asyncio, argparse, collections
+from types import SimpleNamespace
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+os.environ.setdefault("CHAT_ID", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bot as app  # noqa: E402
+import bench_snapshot  # noqa: E402
+from fake_curve import make_payloads  # noqa: E402
+
+MIX = [   # (вес, команда)
+    (40, "/ping"),
+    (10, "/chains"),
+    (15, "/vol 25"),
+    (20, "/{chain} 25 {sort}"),
+    (15, "/top {sort} all 40"),
+]
+
+class FakeTelegram:
+    """Минимальный Bot: get_updates/send_message в памяти, ответы матчатся по чату (FIFO)."""
+    sent_parts = 0
+
+    def __init__(self, send_ms: float):
+        self.send_delay = send_ms / 1000
+        self.latencies = []
+        self._updates = []
+        self._arrived = asyncio.Event()
+        self._next_id = 1
+        self._sent_at = collections.defaultdict(collections.deque)   # chat -> время появления апдейта
+
+    def inject(self, chat_id: int, text: str):
+        self._updates.append(SimpleNamespace(
+            update_id=self._next_id,
+            message=SimpleNamespace(text=text, chat_id=chat_id, from_user=SimpleNamespace(id=1))))
+        self._next_id += 1
+        self._sent_at[chat_id].append(time.perf_counter())
+        self._arrived.set()
+
+    async def get_updates(self, offset=None, timeout=None, **kw):
+        if not self._updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout or 0)
+            except asyncio.TimeoutError:
+                return []
+        out, self._updates = self._updates, []
+        return out
+
+    async def send_message(self, chat_id, text, **kw):
+        await asyncio.sleep(self.send_delay)
+        self.sent_parts += 1
+
+    def replied(self, chat_id):
+        q = self._sent_at.get(chat_id)
+        if q:   # "✅ bot online" в CHAT_ID не считаем
+            self.latencies.append(time.perf_counter() - q.popleft())
+
+async def legacy_loop(session):
+    # старый цикл: обработка прямо в long-poll, фиксированная пауза после пачки
+    offset = 0
+    while True:
+        updates = await app.bot.get_updates(offset=offset, timeout=app.POLL_INTERVAL)
+        for u in updates or []:
+            offset = u.update_id + 1
+            r = app.route(u.message.text.strip())
+            if r is None:
+                continue
+            handler, md, parts = r
+            await app.safe_send(await handler(session, parts), md=md, chat_id=u.message.chat_id)
+        await asyncio.sleep(1.5)
+
+def workload(n: int, chats: int, seed: int = 7):
+    rnd = random.Random(seed)
+    weights, templates = zip(*MIX)
+    cmds = []
+    for _ in range(n):
+        t = rnd.choices(templates, weights)[0]
+        cmds.append((rnd.randint(1, chats), t.format(chain=rnd.choice(app.CHAINS), sort=rnd.choice(app.SORT_KEYS))))
+    return cmds
+
+async def run(mode: str, args, snaps):
+    tg = FakeTelegram(args.send_ms)
+    app.bot = tg
+    app.snapshots = app.SnapshotCache(args.ttl, args.ttl)   # без диска, свежий кэш на каждый режим
+    # лимиты Telegram здесь не меряем; дедуп выключен — каждая команда должна получить ответ
+    app.outbox = app.Outbox(global_rate=1e6, chat_rate=1e6, dedup_s=0)
+
+    async def timed_send(text, *, md=True, chat_id=None):
+        await app.outbox.send(chat_id or app.CHAT_ID, text, md)
+        tg.replied(chat_id)
+    app.safe_send = timed_send
+
+    async def fake_fetch(session, chain, errors=None):
+        await asyncio.sleep(args.fetch_ms / 1000)
+        return snaps[chain]
+    app.fetch_chain_snapshot = fake_fetch
+
+    loop_task = asyncio.create_task(legacy_loop(None) if mode == "legacy" else app.updates_loop())
+    await asyncio.sleep(0.05)
+    cmds = workload(args.commands, args.chats)
+    start = time.perf_counter()
+    for chat, text in cmds:
+        tg.inject(chat, text)
+        await asyncio.sleep(args.burst / len(cmds))
+    while len(tg.latencies) < len(cmds):
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - start
+    loop_task.cancel()
+    await asyncio.gather(loop_task, return_exceptions=True)
+    return sorted(tg.latencies), total
+
+def pctl(xs, p):
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))] * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--commands", type=int, default=150)
+    ap.add_argument("--chats", type=int, default=8)
+    ap.add_argument("--burst", type=float, default=1.0, help="за сколько секунд приходит вся пачка")
+    ap.add_argument("--send-ms", type=float, default=30, help="задержка sendMessage")
+    ap.add_argument("--fetch-ms", type=float, default=400, help="задержка загрузки снапшота сети")
+    ap.add_argument("--ttl", type=float, default=2.0, help="SNAPSHOT_TTL на время прогона")
+    ap.add_argument("--pools", type=int, default=2000)
+    ap.add_argument("--modes", default="legacy,new")
+    args = ap.parse_args()
+
+    snaps = {ch: bench_snapshot.new_build(ch, make_payloads(ch, args.pools, seed=k))[0]
+             for k, ch in enumerate(app.CHAINS)}
+    app.print = lambda *a, **kw: None   # без лога "> /ping" на каждую команду
+
+    print(f"{args.commands} commands from {args.chats} chats in {args.burst:.1f}s, "
+          f"send {args.send_ms:.0f} ms, fetch {args.fetch_ms:.0f} ms\n")
+    print(f"{'':8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'cmd/s':>9}")
+    for mode in args.modes.split(","):
+        lat, total = asyncio.run(run(mode, args, snaps))
+        print(f"{mode:8}{pctl(lat, 50):>7.0f}ms{pctl(lat, 95):>7.0f}ms{pctl(lat, 99):>7.0f}ms"
+              f"{lat[-1] * 1000:>7.0f}ms{len(lat) / total:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# bench_roles.py — пропускная способность команд: 1 коллектор + N ответчиков (ROLE=…)
+#
+#   python bench_roles.py                          # 1, 2, 4 ответчика
+#   python bench_roles.py --responders 1,2,4,8 --commands 2000 --pools 6000
+#   python bench_roles.py --telegram-limits        # с лимитами отправки как у Telegram
+#
+# Поднимает fake_curve.py, один процесс ROLE=collector (публикует снапшоты в
+# SHM_DIR) и для каждого прогона N процессов ROLE=responder — у каждого свой
+# fake_telegram.py (как отдельный токен бота). Все команды прогона приходят
+# разом, поровну на ответчиков; cmd/s = команды / время до последнего ответа.
+# Кэш готовых таблиц выключен (RENDER_CACHE_SIZE=0), чтобы ответчики
+# действительно форматировали, а лимиты отправки сняты — меряется CPU, а не
+# 25 сообщений в секунду. Масштабирование видно только при нескольких ядрах.
+
+import os, sys, json, time, random, shutil, asyncio, argparse, tempfile, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import aiohttp  # noqa: E402
+from bench import _free_port, _wait_up, pctl  # noqa: E402
+
+COMMANDS = ["/{chain} {limit} {sort}", "/top {sort} all {limit}", "/vol {limit}", "/chains"]
+SORTS = ("volume", "tvl", "apy", "rewards")
+
+# ---------- child processes ----------
+def run_child(role: str, api: str, chains: str, tg_base: str = None):
+    # .env загружается с override — поэтому, как в bench.py, настраиваем модуль после импорта
+    import bot as app
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    app.API = api
+    app.CHAINS = chains.split(",")
+    app.print = lambda *a, **kw: None
+    if role == "collector":
+        asyncio.run(app.collector_loop())
+    else:
+        app.bot = Bot(app.TOKEN, base_url=f"{tg_base}/bot",
+                      request=HTTPXRequest(connection_pool_size=app.TG_CONNECTIONS))
+        asyncio.run(app.updates_loop())
+
+def child_env(args, shm: str):
+    env = dict(os.environ, SHM_DIR=shm, STORE_PATH="", METRICS_PORT="0", CACHE_WARM="0",
+               RENDER_CACHE_SIZE="0", SNAPSHOT_TTL="3600", SNAPSHOT_MAX_STALE="7200")
+    if not args.telegram_limits:
+        env.update(SEND_RATE_GLOBAL="1000000", SEND_RATE_CHAT="1000000", SEND_DEDUP_S="0")
+    return env
+
+def spawn(env, role: str, *child_args):
+    # ROLE — через окружение: его читает уже импорт bot
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "_child", role, *child_args],
+                            env=dict(env, ROLE=role), stdout=subprocess.DEVNULL)
+
+def stop(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+# ---------- run ----------
+async def wait_published(shm: str, chains, proc, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while not all(os.path.exists(os.path.join(shm, f"{ch}.json")) for ch in chains):
+        if proc.poll() is not None:
+            raise SystemExit("collector exited")
+        if time.monotonic() > deadline:
+            raise SystemExit("collector published nothing")
+        await asyncio.sleep(0.1)
+
+async def wait_polling(s, tg_base: str, proc, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("responder exited")
+        async with s.get(f"{tg_base}/_stats") as r:
+            if (await r.json())["polls"]:
+                return
+        await asyncio.sleep(0.05)
+    raise SystemExit("responder does not poll")
+
+def workload(n: int, chains, seed: int = 7):
+    rnd = random.Random(seed)
+    return [rnd.choice(COMMANDS).format(chain=rnd.choice(chains), sort=rnd.choice(SORTS),
+                                        limit=rnd.randint(10, 40)) for _ in range(n)]
+
+async def run_responders(k: int, args, env, api: str):
+    tgs, resp, bases = [], [], []
+    for _ in range(k):
+        port = _free_port()
+        tgs.append(subprocess.Popen([sys.executable, os.path.join(HERE, "fake_telegram.py"), "--port", str(port),
+                                     "--send-ms", str(args.send_ms)], stdout=subprocess.DEVNULL))
+        bases.append(f"http://127.0.0.1:{port}")
+    try:
+        for tg, base in zip(tgs, bases):
+            await _wait_up(f"{base}/_stats", tg)
+        for base in bases:
+            resp.append(spawn(env, "responder", api, ",".join(args.chains), base))
+        cmds = workload(args.commands, args.chains)
+        async with aiohttp.ClientSession() as s:
+            for p, base in zip(resp, bases):
+                await wait_polling(s, base, p)
+                await s.post(f"{base}/_reset")
+            # одна команда на чат, команды поровну между ответчиками
+            batches = [[{"chat_id": 1000 + i, "text": t} for i, t in enumerate(cmds) if i % k == j] for j in range(k)]
+            await asyncio.gather(*(s.post(f"{base}/_inject", json=b) for base, b in zip(bases, batches)))
+            deadline = time.monotonic() + args.timeout
+            while True:
+                stats = []
+                for base in bases:
+                    async with s.get(f"{base}/_stats") as r:
+                        stats.append(await r.json())
+                done = sum(1 for st in stats for c in st["chats"].values() if c["out"])
+                if done >= len(cmds) or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.1)
+    finally:
+        stop(resp + tgs)
+    chats = [c for st in stats for c in st["chats"].values()]
+    lat = [c["out"][-1] - c["in"][0] for c in chats if c["out"]]
+    first = min(c["in"][0] for c in chats)
+    last = max((c["out"][-1] for c in chats if c["out"]), default=first)
+    return {"n": len(lat), "wall": last - first, "ops": len(lat) / max(last - first, 1e-9),
+            "p50": pctl(lat, 50), "p99": pctl(lat, 99)}
+
+async def run(args):
+    shm = tempfile.mkdtemp(prefix="curvebot-shm-")
+    curve_port = _free_port()
+    curve = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_curve.py"), "serve", "--port", str(curve_port),
+        "--chains", ",".join(args.chains), "--pools", str(args.pools)], stdout=subprocess.DEVNULL)
+    api = f"http://127.0.0.1:{curve_port}/v1"
+    env = child_env(args, shm)
+    collector = None
+    try:
+        await _wait_up(f"http://127.0.0.1:{curve_port}/_stats", curve)
+        collector = spawn(env, "collector", api, ",".join(args.chains))
+        await wait_published(shm, args.chains, collector)
+        results = {}
+        for k in args.responders:
+            results[k] = await run_responders(k, args, env, api)
+        return results
+    finally:
+        stop([p for p in (collector, curve) if p is not None])
+        shutil.rmtree(shm, ignore_errors=True)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_child":
+        return run_child(*sys.argv[2:])
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--responders", default="1,2,4", help="числа ответчиков через запятую")
+    ap.add_argument("--chains", default="ethereum,arbitrum,polygon")
+    ap.add_argument("--pools", type=int, default=4000, help="пулов на сеть в fake_curve")
+    ap.add_argument("--commands", type=int, default=600, help="команд на прогон (всего)")
+    ap.add_argument("--send-ms", type=float, default=5, help="задержка sendMessage в fake_telegram")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--telegram-limits", action="store_true", help="оставить SEND_RATE_* по умолчанию")
+    ap.add_argument("--json", help="сохранить результат в файл")
+    args = ap.parse_args()
+    args.chains = [c.strip() for c in args.chains.split(",") if c.strip()]
+    args.responders = [int(x) for x in args.responders.split(",") if x.strip()]
+
+    results = asyncio.run(run(args))
+    print(f"{len(args.chains)} chains × {args.pools} pools, {args.commands} commands per run, "
+          f"{os.cpu_count()} CPU(s)\n")
+    print(f"{'responders':>10}{'answered':>10}{'wall s':>9}{'cmd/s':>9}{'speedup':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    base = results[args.responders[0]]["ops"]
+    for k, r in results.items():
+        print(f"{k:>10}{r['n']:>10}{r['wall']:>9.2f}{r['ops']:>9.1f}{r['ops'] / base:>8.2f}x"
+              f"{r['p50']:>9.0f}{r['p99']:>9.0f}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"},
+                       "results": results}, fh, indent=2)
+
+if __name__ == "__main__":
+    main()
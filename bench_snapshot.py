@@ -0,0 +1,163 @@
+# bench_snapshot.py — сравнение старого dict-пайплайна и колоночного ChainSnapshot
+#
+#   python bench_snapshot.py                 # ~4000 пулов на 9 реестров
+#   python bench_snapshot.py --pools 12000 --runs 7
+#
+# Берёт payload'ы /getPools (все реестры), /getVolumes и /getBaseApys из
+# fake_curve.make_payloads и гоняет на них:
+#   legacy — как было: json (stdlib) → setdefault/update → list[dict] → sorted + dict(r)
+#   new    — orjson → PoolInfo → merge_chain → ChainSnapshot.top_rows
+# Печатает медианную задержку и память (пик при сборке и сколько держит результат).
+
+import os, sys, json, time, argparse, statistics, tracemalloc
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+os.environ.setdefault("CHAT_ID", "0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bot  # noqa: E402
+
+import orjson  # noqa: E402
+from fake_curve import make_payloads  # noqa: E402
+
+SORTS = ("volume", "tvl", "apy", "rewards")
+
+# ---------- legacy (как в bot.py до колоночного снапшота) ----------
+def legacy_pool_link(chain: str, pool):
+    # 1) «dex/#/...» из poolUrls
+    u = bot._dex_url(pool.get("poolUrls"))
+    if u:
+        return u
+    # 2) иначе универсальная ссылка по адресу (не всегда откроет красивый slug, но работает)
+    addr = pool.get("address") or pool.get("_addr") or ""
+    return f"https://curve.fi/#/{chain}/pool/{addr}"
+
+def legacy_build(chain: str, bodies: dict):
+    vols = json.loads(bodies["getVolumes"].decode())
+    volumes = {}
+    for r in (vols.get("data", {}).get("pools") or []):
+        addr = (r.get("address") or "").lower()
+        if addr:
+            volumes[addr] = float(r.get("volumeUSD") or 0)
+    apys = json.loads(bodies["getBaseApys"].decode())
+    base_apy = {}
+    for r in (apys.get("data", {}).get("baseApys") or []):
+        addr = (r.get("address") or "").lower()
+        if addr:
+            ap = r.get("latestWeeklyApyPcent")
+            if ap is None:
+                ap = r.get("latestDailyApyPcent")
+            base_apy[addr] = float(ap or 0)
+    pools_by_addr = {}
+    for reg in bot.REGISTRIES:
+        data = json.loads(bodies[f"getPools/{reg}"].decode())
+        for p in (data.get("data", {}).get("poolData") or []):
+            addr = (p.get("address") or "").lower()
+            if not addr:
+                continue
+            pools_by_addr.setdefault(addr, {})
+            pools_by_addr[addr].update({
+                "name": p.get("name") or p.get("symbol"),
+                "tvl": float(p.get("usdTotal") or 0),
+                "poolUrls": p.get("poolUrls") or {},
+                "address": p.get("address"),
+            })
+            crv_arr = p.get("gaugeCrvApy") or []
+            if isinstance(crv_arr, list) and crv_arr:
+                pools_by_addr[addr]["crvApr"] = max([float(x or 0) for x in crv_arr])
+            else:
+                pools_by_addr[addr]["crvApr"] = 0.0
+    result = []
+    for addr, info in pools_by_addr.items():
+        v = volumes.get(addr, 0.0)
+        apy = base_apy.get(addr, 0.0)
+        tvl = float(info.get("tvl") or 0)
+        crv = float(info.get("crvApr") or 0.0)
+        if bot.HIDE_ZERO and (tvl <= 0 or (abs(apy) < 1e-9 and v <= 1.0)):
+            continue
+        if tvl < bot.MIN_TVL:
+            continue
+        result.append({
+            "address": addr, "name": info.get("name") or addr[:8], "tvl": tvl, "volume": v,
+            "baseApy": apy, "rewardsApr": crv, "link": legacy_pool_link(chain, info),
+        })
+    # pools_by_addr в старом коде жил до конца функции — держим его в результате для честной памяти
+    return result, pools_by_addr
+
+def legacy_top(rows, sort_key, limit):
+    keyf = {
+        "volume":  lambda x: float(x.get("volume") or 0),
+        "tvl":     lambda x: float(x.get("tvl") or 0),
+        "apy":     lambda x: float(x.get("baseApy") or 0),
+        "rewards": lambda x: float(x.get("rewardsApr") or 0),
+    }[sort_key]
+    return sorted([dict(r) for r in rows], key=keyf, reverse=True)[:limit]
+
+# ---------- new ----------
+def new_build(chain: str, bodies: dict):
+    bot._merge_state.pop(chain, None)   # холодная сборка, без переиспользования
+    volumes = bot._parse_volumes(orjson.loads(bodies["getVolumes"]))
+    base_apy = bot._parse_base_apys(orjson.loads(bodies["getBaseApys"]))
+    by_reg = {reg: bot._parse_pools(orjson.loads(bodies[f"getPools/{reg}"])) for reg in bot.REGISTRIES}
+    snap = bot.merge_chain(chain, volumes, base_apy, by_reg)
+    return snap, bot._merge_state[chain]
+
+def new_top(snap, sort_key, limit):
+    return snap.top_rows(sort_key, limit)
+
+# ---------- measure ----------
+def timed(fn, runs):
+    out = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return statistics.median(out) * 1000
+
+def memory(fn):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    keep = fn()
+    cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keep
+    return (cur - base) / 2**20, (peak - base) / 2**20
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pools", type=int, default=4000, help="пулов на сеть (по всем реестрам)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--limit", type=int, default=25)
+    args = ap.parse_args()
+
+    chain = "ethereum"
+    bodies = make_payloads(chain, args.pools)
+    size = sum(len(b) for b in bodies.values()) / 2**20
+
+    legacy_rows, _ = legacy_build(chain, bodies)
+    snap, _ = new_build(chain, bodies)
+    assert len(legacy_rows) == len(snap), (len(legacy_rows), len(snap))
+    for s in SORTS:
+        a = [r["address"] for r in legacy_top(legacy_rows, s, args.limit)]
+        b = [r["address"] for r in new_top(snap, s, args.limit)]
+        assert a == b, f"top mismatch for {s}"
+
+    res = {}
+    for name, build, top in (("legacy", legacy_build, legacy_top), ("new", new_build, new_top)):
+        built = build(chain, bodies)[0]
+        res[name] = {
+            "build_ms": timed(lambda: build(chain, bodies), args.runs),
+            "top_ms": timed(lambda: [top(built, s, args.limit) for s in SORTS], args.runs * 4) / len(SORTS),
+            "mem": memory(lambda: build(chain, bodies)),
+        }
+
+    print(f"payload: {args.pools} pools, {size:.1f} MiB JSON, {len(snap)} rows after filters\n")
+    print(f"{'':8}{'decode+merge':>14}{'top-' + str(args.limit):>10}{'retained':>12}{'peak':>10}")
+    for name, r in res.items():
+        kept, peak = r["mem"]
+        print(f"{name:8}{r['build_ms']:>11.1f} ms{r['top_ms']:>7.2f} ms{kept:>8.1f} MiB{peak:>6.1f} MiB")
+    lg, nw = res["legacy"], res["new"]
+    print(f"\nspeedup: build x{lg['build_ms'] / nw['build_ms']:.1f}, top x{lg['top_ms'] / nw['top_ms']:.1f}; "
+          f"retained memory x{lg['mem'][0] / max(nw['mem'][0], 1e-9):.1f} less")
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,71 @@
 #   /<chain> [limit] [sort]        → /ethereum 25 volume
 #   /vol [limit]  | /apy [limit] | /tvl [limit] | /rewards [limit]   (по умолчанию chain=ethereum)
 #   /top <sort> all [limit]        → /top volume all 40
+#   /cache                         → счётчики кэша снапшотов
+#   /stats, /profile on|off        → задержки и профилирование (только ADMIN_IDS)
+#   /watch tvl|apy|new …, /unwatch → подписки на изменения пулов (см. /help)
+#   /movers <chain> [window] [sort] → кто сильнее всех изменился за окно (1h, 6h, 1d…)
+#   /trend <chain> <pool> [window] → спарклайны TVL / volume / APY пула
 #
 # Переменные в .env:
 # TELEGRAM_TOKEN=xxxxxxxx:yyyyyyyyyyyy
 # CHAT_ID=-100xxxxxxxxx
 # CHAINS=ethereum,arbitrum,polygon
 # POLL_INTERVAL=60
-# REQUEST_TIMEOUT=25
+# REQUEST_TIMEOUT=25      # общий дедлайн на один источник, со всеми повторами
 # INSECURE_SSL=0          # 1 — игнорировать проверку SSL (как временный фолбэк)
 # HIDE_ZERO=1             # скрывать пулы с нулевыми полями
 # MIN_TVL=1000000         # фильтр по минимальному TVL в USD
 # DEFAULT_CHAIN=ethereum  # для коротких команд /vol, /apy, /tvl, /rewards
+# CURVE_API_BASE=https://api.curve.finance/v1        # другой адрес — напр. fake_curve.py
+# TELEGRAM_API_BASE=https://api.telegram.org/bot     # другой адрес — напр. fake_telegram.py
+# TG_CONNECTIONS=8        # соединений к Bot API для отправки (у PTB по умолчанию одно — отправки в очередь)
+# FETCH_CONCURRENCY=64    # максимум параллельных запросов к Curve API
+# FETCH_PER_HOST=32       # максимум параллельных запросов на один хост
+# FETCH_ATTEMPT_TIMEOUT=8 # таймаут одной попытки
+# FETCH_RETRIES=2         # повторов после первой попытки (с jitter backoff)
+# FETCH_BACKOFF=0.5       # базовая пауза перед повтором, сек (удваивается)
+# FETCH_HEDGE_MS=0        # >0 — дублирующий запрос, если первый молчит дольше
+# BREAKER_FAILS=3         # подряд неудач, после которых источник «выключается»
+# BREAKER_COOLDOWN=30     # сколько секунд не ходить в выключенный источник
+# SNAPSHOT_TTL=60         # сколько секунд снапшот сети считается свежим
+# SNAPSHOT_MAX_STALE=900  # до этого возраста отдаём устаревший снапшот и обновляем в фоне
+# CACHE_WARM=0            # 1 — фоном держать все CHAINS свежими
+# STORE_PATH=snapshots.db # SQLite со снапшотами для тёплого рестарта (пусто — выключить)
+# STORE_KEEP=3            # сколько последних снапшотов хранить на сеть
+# STORE_MAX_AGE_H=168     # снапшоты старше — удаляются
+# DISPATCH_WORKERS=8      # сколько команд обрабатывается одновременно
+# SEND_RATE_GLOBAL=25     # сообщений в секунду на весь бот (лимит Telegram ~30/с)
+# SEND_RATE_CHAT=1        # сообщений в секунду в один чат
+# SEND_DEDUP_S=2          # одинаковое сообщение в тот же чат чаще — не дублируем
+# RENDER_CACHE_SIZE=256   # сколько готовых таблиц держать в кэше
+# METRICS_HOST=127.0.0.1  # где слушает сервер /metrics и /debug/profile
+# METRICS_PORT=0          # >0 — /metrics (Prometheus) на METRICS_HOST:PORT
+# ADMIN_IDS=              # user id через запятую для /stats и /profile (пусто — любой из CHAT_ID)
+# PROFILE_DIR=profiles    # куда /profile off пишет собранные стеки
+# WEBHOOK_URL=            # https://host/path — принимать апдейты webhook'ом вместо getUpdates
+# WEBHOOK_HOST=0.0.0.0    # где слушает встроенный сервер (за reverse proxy / TLS)
+# WEBHOOK_PORT=8443
+# WEBHOOK_PATH=           # путь на локальном сервере (по умолчанию — путь из WEBHOOK_URL)
+# WEBHOOK_SECRET=         # X-Telegram-Bot-Api-Secret-Token (пусто — случайный на каждый запуск)
+# WATCH_MAX=20            # подписок /watch на один чат
+# WATCH_BATCH_S=3         # уведомления в чат копятся столько секунд и уходят одним сообщением
+# SERIES_POOLS=512        # пулов на сеть в истории метрик (дальше вытесняются давно не виденные)
+# SERIES_TIERS=60:240,1800:336  # ярусы истории «ширина бакета, сек : бакетов» — 4 часа по минуте, 7 дней по 30 мин
+# SERIES_SAVE_S=300       # как часто сохранять историю в STORE_PATH
+# ROLE=all                # all — всё в одном процессе; collector — только опрос Curve API и
+#                         # публикация снапшотов в SHM_DIR; responder — только команды, снапшоты из SHM_DIR
+# SHM_DIR=shm             # каталог mmap-файлов снапшотов (лучше на tmpfs, напр. /dev/shm/curvebot)
 
-import os, ssl, certifi, asyncio, aiohttp, math
-from aiohttp import ClientTimeout
-from datetime import datetime, timezone
+import os, sys, ssl, certifi, asyncio, aiohttp, math, weakref, time, random, hashlib, hmac, secrets, heapq, itertools, collections, functools, bisect, threading, sqlite3, mmap, struct, orjson
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from urllib.parse import urlsplit
+from aiohttp import ClientTimeout, web
+from datetime import datetime, timedelta, timezone
 from telegram import Bot, constants
-from telegram.error import ChatMigrated
+from telegram.error import ChatMigrated, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 
 # ---------- ENV ----------
@@ -36,13 +84,55 @@ INSECURE_SSL    = (os.getenv("INSECURE_SSL", "0") == "1")
 HIDE_ZERO       = (os.getenv("HIDE_ZERO", "1") == "1")
 MIN_TVL         = float(os.getenv("MIN_TVL", "1000000"))   # 1M по умолчанию
 DEFAULT_CHAIN   = (os.getenv("DEFAULT_CHAIN") or "ethereum").lower()
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "64"))  # всего запросов к API одновременно
+FETCH_PER_HOST    = int(os.getenv("FETCH_PER_HOST", "32"))     # из них на один хост
+FETCH_ATTEMPT_TIMEOUT = float(os.getenv("FETCH_ATTEMPT_TIMEOUT", "8"))
+FETCH_RETRIES         = int(os.getenv("FETCH_RETRIES", "2"))
+FETCH_BACKOFF         = float(os.getenv("FETCH_BACKOFF", "0.5"))
+FETCH_HEDGE_MS        = float(os.getenv("FETCH_HEDGE_MS", "0"))
+BREAKER_FAILS         = int(os.getenv("BREAKER_FAILS", "3"))
+BREAKER_COOLDOWN      = float(os.getenv("BREAKER_COOLDOWN", "30"))
+SNAPSHOT_TTL       = int(os.getenv("SNAPSHOT_TTL", "60"))
+SNAPSHOT_MAX_STALE = int(os.getenv("SNAPSHOT_MAX_STALE", "900"))
+CACHE_WARM         = (os.getenv("CACHE_WARM", "0") == "1")
+STORE_PATH         = (os.getenv("STORE_PATH", "snapshots.db") or "").strip()
+STORE_KEEP         = int(os.getenv("STORE_KEEP", "3"))
+STORE_MAX_AGE_H    = float(os.getenv("STORE_MAX_AGE_H", "168"))
+DISPATCH_WORKERS   = int(os.getenv("DISPATCH_WORKERS", "8"))
+SEND_RATE_GLOBAL   = float(os.getenv("SEND_RATE_GLOBAL", "25"))
+SEND_RATE_CHAT     = float(os.getenv("SEND_RATE_CHAT", "1"))
+SEND_DEDUP_S       = float(os.getenv("SEND_DEDUP_S", "2"))
+RENDER_CACHE_SIZE  = int(os.getenv("RENDER_CACHE_SIZE", "256"))
+METRICS_HOST       = (os.getenv("METRICS_HOST") or "127.0.0.1").strip()
+METRICS_PORT       = int(os.getenv("METRICS_PORT", "0"))
+ADMIN_IDS          = {int(x) for x in (os.getenv("ADMIN_IDS") or "").replace(" ", "").split(",") if x}
+PROFILE_DIR        = (os.getenv("PROFILE_DIR") or "profiles").strip()
+WEBHOOK_URL        = (os.getenv("WEBHOOK_URL") or "").strip()
+WEBHOOK_HOST       = (os.getenv("WEBHOOK_HOST") or "0.0.0.0").strip()
+WEBHOOK_PORT       = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH       = (os.getenv("WEBHOOK_PATH") or urlsplit(WEBHOOK_URL).path or "/").strip()
+WEBHOOK_SECRET     = (os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)).strip()
+WATCH_MAX          = int(os.getenv("WATCH_MAX", "20"))
+WATCH_BATCH_S      = float(os.getenv("WATCH_BATCH_S", "3"))
+SERIES_POOLS       = int(os.getenv("SERIES_POOLS", "512"))
+SERIES_TIERS       = [tuple(int(x) for x in t.split(":")) for t in
+                      (os.getenv("SERIES_TIERS") or "60:240,1800:336").replace(" ", "").split(",") if t]
+SERIES_SAVE_S      = float(os.getenv("SERIES_SAVE_S", "300"))
+ROLE               = (os.getenv("ROLE") or "all").strip().lower()
+SHM_DIR            = (os.getenv("SHM_DIR") or "shm").strip()
 
-if not TOKEN or ":" not in TOKEN:
-    raise SystemExit("Bad TELEGRAM_TOKEN in .env")
-if not CHAT_ID:
-    raise SystemExit("Set CHAT_ID in .env")
+if ROLE not in ("all", "collector", "responder"):
+    raise SystemExit("ROLE must be all, collector or responder")
+if ROLE != "collector":   # коллектору Telegram не нужен
+    if not TOKEN or ":" not in TOKEN:
+        raise SystemExit("Bad TELEGRAM_TOKEN in .env")
+    if not CHAT_ID:
+        raise SystemExit("Set CHAT_ID in .env")
 
-bot = Bot(TOKEN)
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE") or "https://api.telegram.org/bot").strip()
+TG_CONNECTIONS    = int(os.getenv("TG_CONNECTIONS", "8"))
+bot = Bot(TOKEN, base_url=TELEGRAM_API_BASE,
+          request=HTTPXRequest(connection_pool_size=TG_CONNECTIONS)) if ROLE != "collector" else None
 
 # ---------- SSL ----------
 SSL_CTX_VERIFIED = ssl.create_default_context(cafile=certifi.where())
@@ -53,7 +143,7 @@ def _ctx():
     return SSL_CTX_INSECURE if INSECURE_SSL else SSL_CTX_VERIFIED
 
 # ---------- API ----------
-API = "https://api.curve.finance/v1"
+API = (os.getenv("CURVE_API_BASE") or "https://api.curve.finance/v1").strip().rstrip("/")
 HEADERS = {"User-Agent": "curve-bot/1.0"}
 
 REGISTRIES = [
@@ -73,6 +163,15 @@ def usd_short(x):
     if v >= 1e3:  return f"${v/1e3:.2f}k"
     return f"${v:.0f}"
 
+def parse_usd(s: str):
+    # "1.5m", "500k", "$2B", "1000000" -> float; None, если не число
+    s = (s or "").strip().lower().lstrip("$")
+    mult = {"k": 1e3, "m": 1e6, "b": 1e9}.get(s[-1:], 1)
+    try:
+        return float(s[:-1] if mult != 1 else s) * mult
+    except ValueError:
+        return None
+
 def pct(x):
     try:
         return f"{float(x):.2f}%"
@@ -86,55 +185,358 @@ def safe_name(s: str) -> str:
     s = (s or "").replace("[", "").replace("]", "").replace("(", "").replace(")", "")
     return s.replace("_", "\\_")  # чтобы Markdown не ломался
 
-def pool_link(chain: str, pool):
-    # 1) предпочитаем «dex/#/...», если API отдал poolUrls
-    urls = (pool.get("poolUrls") or {})
+def _dex_url(urls):
+    # предпочитаем «dex/#/...», если API отдал poolUrls
     for cat in ("swap", "deposit", "withdraw"):
-        arr = urls.get(cat) or []
+        arr = (urls or {}).get(cat) or []
         for u in arr:
             if "dex/#" in u:
                 return u
-    # 2) иначе универсальная ссылка по адресу (не всегда откроет красивый slug, но работает)
-    addr = pool.get("address") or pool.get("_addr") or ""
-    return f"https://curve.fi/#/{chain}/pool/{addr}"
+    return None
+
+# ---------- metrics ----------
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q: float):
+        # верхняя граница бакета, в который попал q-квантиль (грубо, но без хранения значений)
+        if not self.count:
+            return None
+        need, acc = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= need:
+                return self.buckets[i] if i < len(self.buckets) else math.inf
+        return math.inf
+
+class Metrics:
+    """
+    Счётчики, gauge'и и гистограммы с метками; render() — текст в формате
+    Prometheus. collector(fn) — значения, которые считываются в момент
+    запроса (fn возвращает [(тип, имя, {метки}, значение), ...]); повторная
+    регистрация под тем же именем заменяет прежний.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self._counters = collections.defaultdict(float)   # (имя, метки) -> значение
+        self._gauges = {}
+        self._hists = {}
+        self._collectors = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self._counters[self._key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        h = self._hists.get(key)
+        if h is None:
+            h = self._hists[key] = Histogram(buckets)
+        h.observe(value)
+
+    def hist(self, name: str, **labels):
+        return self._hists.get(self._key(name, labels))
+
+    def hists(self, name: str):
+        # [({метки}, Histogram), ...] для всех серий одной метрики
+        return [(dict(labels), h) for (n, labels), h in self._hists.items() if n == name]
+
+    def gauge(self, name: str, **labels):
+        return self._gauges.get(self._key(name, labels))
+
+    def collector(self, name: str, fn):
+        self._collectors[name] = fn
+
+    def render(self) -> str:
+        def lbl(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+        lines, typed = [], set()
+        def head(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        counters, gauges = dict(self._counters), dict(self._gauges)
+        for fn in self._collectors.values():
+            for kind, name, labels, value in fn():
+                (counters if kind == "counter" else gauges)[self._key(name, labels)] = value
+        for (name, labels), v in sorted(counters.items()):
+            head(name, "counter")
+            lines.append(f"{name}{lbl(labels)} {v:g}")
+        for (name, labels), v in sorted(gauges.items()):
+            head(name, "gauge")
+            lines.append(f"{name}{lbl(labels)} {v:g}")
+        for (name, labels), h in sorted(self._hists.items()):
+            head(name, "histogram")
+            acc = 0
+            for b, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                acc += c
+                lines.append(f"{name}_bucket{lbl(labels, [('le', b if b == '+Inf' else f'{b:g}')])} {acc}")
+            lines.append(f"{name}_sum{lbl(labels)} {h.sum:g}")
+            lines.append(f"{name}_count{lbl(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# ---------- http client ----------
+def http_session():
+    # общий пул соединений: keep-alive, кэш DNS, лимиты как у fetch_many
+    conn = aiohttp.TCPConnector(limit=FETCH_CONCURRENCY, limit_per_host=FETCH_PER_HOST,
+                                ttl_dns_cache=300, keepalive_timeout=60)
+    return aiohttp.ClientSession(headers=HEADERS, connector=conn)
 
-async def _get_json(session: aiohttp.ClientSession, url: str):
+class CircuitOpen(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    closed → после fails неудач подряд open (сразу отказ) на cooldown секунд,
+    потом half-open: пропускаем одну пробную загрузку; успех закрывает.
+    """
+    __slots__ = ("fails", "opened_at", "trial")
+
+    def __init__(self):
+        self.fails, self.opened_at, self.trial = 0, None, False
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.fails, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        self.fails += 1
+        self.trial = False
+        if self.fails >= BREAKER_FAILS:
+            self.opened_at = time.monotonic()
+
+_breakers = collections.defaultdict(CircuitBreaker)   # url -> CircuitBreaker
+
+async def _fetch_raw(session: aiohttp.ClientSession, url: str, headers: dict, ssl_ctx, timeout: float):
+    async with session.get(url, headers={**HEADERS, **headers}, ssl=ssl_ctx,
+                           timeout=ClientTimeout(total=timeout)) as r:
+        if r.status == 304:
+            return 304, r.headers, b""
+        r.raise_for_status()
+        return r.status, r.headers, await r.read()
+
+async def _fetch_once(session, url: str, headers: dict, timeout: float):
     try:
-        async with session.get(url, headers=HEADERS, ssl=_ctx(), timeout=ClientTimeout(total=REQUEST_TIMEOUT)) as r:
-            r.raise_for_status()
-            return await r.json()
-    except Exception:
-        if not INSECURE_SSL:  # пробуем фолбэк на insecure только если он ещё не включён
+        return await _fetch_raw(session, url, headers, _ctx(), timeout)
+    except (aiohttp.ClientSSLError, ssl.SSLError):
+        if INSECURE_SSL:
+            raise
+    # фолбэк на insecure — только при ошибке SSL и только если он ещё не включён
+    return await _fetch_raw(session, url, headers, SSL_CTX_INSECURE, timeout)
+
+async def _first_ok(tasks):
+    # первый успешный результат; если упали все — последняя ошибка
+    pending, err = set(tasks), None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                err = t.exception()
+        raise err
+    finally:
+        for t in pending:
+            t.cancel()
+
+async def _attempt(session, url: str, headers: dict, timeout: float):
+    first = asyncio.ensure_future(_fetch_once(session, url, headers, timeout))
+    if FETCH_HEDGE_MS <= 0:
+        return await first
+    hedge = FETCH_HEDGE_MS / 1000
+    done, _ = await asyncio.wait({first}, timeout=min(hedge, timeout))
+    if done:
+        return first.result()
+    # первый запрос застрял в хвосте — параллельно шлём второй, берём кто быстрее
+    source_stats["hedged"] += 1
+    second = asyncio.ensure_future(_fetch_once(session, url, headers, max(timeout - hedge, 0.1)))
+    return await _first_ok([first, second])
+
+def _retryable(e: Exception):
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+async def _fetch_body(session: aiohttp.ClientSession, url: str, headers: dict = None):
+    """
+    Тело ответа (status, headers, bytes) с повторами: таймаут на попытку
+    FETCH_ATTEMPT_TIMEOUT, общий дедлайн REQUEST_TIMEOUT, пауза между
+    попытками — случайная до FETCH_BACKOFF * 2^n. Источник, который падает
+    раз за разом, circuit breaker на время отключает — сразу CircuitOpen.
+    Ошибку не глотаем — её видно в отчёте по источникам.
+    """
+    br = _breakers[url]
+    if not br.allow():
+        source_stats["fail_fast"] += 1
+        raise CircuitOpen("circuit open")
+    trial = br.is_open()   # half-open: это и есть пробная загрузка
+    headers = headers or {}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + REQUEST_TIMEOUT
+    try:
+        for attempt in itertools.count():
+            left = deadline - loop.time()
             try:
-                async with session.get(url, headers=HEADERS, ssl=SSL_CTX_INSECURE, timeout=ClientTimeout(total=REQUEST_TIMEOUT)) as r:
-                    r.raise_for_status()
-                    return await r.json()
-            except Exception:
-                return {"error": "fetch_failed"}
-        return {"error": "fetch_failed"}
+                res = await _attempt(session, url, headers, min(FETCH_ATTEMPT_TIMEOUT, left))
+            except Exception as e:
+                if not _retryable(e):
+                    br.success()   # 4xx — проблема запроса, а не доступности источника
+                    raise
+                pause = random.uniform(0, FETCH_BACKOFF * 2 ** attempt)
+                if attempt >= FETCH_RETRIES or loop.time() + pause >= deadline:
+                    br.failure()
+                    raise
+                source_stats["retried"] += 1
+                await asyncio.sleep(pause)
+                continue
+            br.success()
+            return res
+    finally:
+        if trial:
+            # отменённая пробная загрузка (CancelledError мимо except Exception) не
+            # должна держать источник выключенным навсегда — следующая снова пробная
+            br.trial = False
 
-# ---------- fetch & merge ----------
-async def fetch_chain_snapshot(session: aiohttp.ClientSession, chain: str):
+# ---------- per-source cache ----------
+# Последний ответ каждого URL: валидаторы (ETag/Last-Modified), хэш тела и уже
+# разобранный результат. Если источник не изменился — не декодируем и не
+# парсим его заново, а отдаём тот же объект (по нему же склейка понимает,
+# что пересобирать нечего).
+_sources = {}   # url -> {"etag", "last_modified", "digest", "parsed"}
+source_stats = {"not_modified": 0, "same_body": 0, "parsed": 0,
+                "retried": 0, "hedged": 0, "fail_fast": 0, "stale": 0}
+
+async def fetch_source(session: aiohttp.ClientSession, url: str, parse):
+    prev = _sources.get(url)
+    headers = {}
+    if prev:
+        if prev["etag"]:
+            headers["If-None-Match"] = prev["etag"]
+        if prev["last_modified"]:
+            headers["If-Modified-Since"] = prev["last_modified"]
+    status, resp_headers, body = await _fetch_body(session, url, headers)
+    metrics.observe("curvebot_fetch_bytes", len(body), SIZE_BUCKETS, **_source_labels(url))
+    if status == 304 and prev:
+        source_stats["not_modified"] += 1
+        return prev["parsed"]
+    digest = hashlib.blake2b(body, digest_size=16).digest()
+    if prev and prev["digest"] == digest:
+        source_stats["same_body"] += 1
+        parsed = prev["parsed"]
+    else:
+        source_stats["parsed"] += 1
+        parsed = parse(orjson.loads(body))
+    _sources[url] = {
+        "etag": resp_headers.get("ETag"),
+        "last_modified": resp_headers.get("Last-Modified"),
+        "digest": digest,
+        "parsed": parsed,
+    }
+    return parsed
+
+# ---------- concurrent fetch ----------
+# Лимиты живут на своём event loop (семафоры нельзя делить между loop'ами).
+_limits = weakref.WeakKeyDictionary()   # loop -> (global_sem, {host: sem})
+
+def _slots(url: str):
+    loop = asyncio.get_running_loop()
+    lim = _limits.get(loop)
+    if lim is None:
+        lim = _limits[loop] = (asyncio.Semaphore(FETCH_CONCURRENCY), {})
+    glob, hosts = lim
+    host = urlsplit(url).netloc
+    if host not in hosts:
+        hosts[host] = asyncio.Semaphore(FETCH_PER_HOST)
+    return glob, hosts[host]
+
+def _source_labels(url: str):
+    # .../getPools/{chain}/{registry} -> endpoint, chain, registry
+    parts = url[len(API) + 1:].split("/") if url.startswith(API) else [url]
+    return {"endpoint": parts[0], "chain": parts[1] if len(parts) > 1 else "",
+            "registry": parts[2] if len(parts) > 2 else ""}
+
+async def _fetch_limited(session, name: str, url: str, parse):
+    glob, per_host = _slots(url)
+    labels = _source_labels(url)
+    async with glob, per_host:
+        t = time.perf_counter()
+        try:
+            parsed = await fetch_source(session, url, parse)
+            metrics.observe("curvebot_fetch_seconds", time.perf_counter() - t, **labels)
+            metrics.inc("curvebot_fetch_total", result="ok", **labels)
+            return name, parsed, None
+        except Exception as e:
+            metrics.observe("curvebot_fetch_seconds", time.perf_counter() - t, **labels)
+            metrics.inc("curvebot_fetch_total", result="error", **labels)
+            err = str(e) or e.__class__.__name__
+    # источник не ответил — отдаём последний удачный ответ, если он был
+    prev = _sources.get(url)
+    if prev is not None:
+        source_stats["stale"] += 1
+        return name, prev["parsed"], f"stale: {err}"
+    return name, None, err
+
+async def fetch_many(session: aiohttp.ClientSession, sources: dict):
     """
-    Собираем:
-      - TVL + имя + ссылки из /getPools/{registry}
-      - Volume из /getVolumes/{chain}
-      - Base vAPY из /getBaseApys/{chain}
-      - CRV APR из поля gaugeCrvApy в /getPools
-    Склейка по адресу пула (lowercase).
+    Параллельно тянет {name: (url, parse)} под глобальным и per-host лимитом.
+    Отдаёт (name, parsed, error) по мере готовности — быстрые источники
+    не ждут медленных. При ошибке parsed — прошлый удачный ответ или None.
     """
-    # 1) объёмы (по адресу)
-    vols = await _get_json(session, f"{API}/getVolumes/{chain}")
+    tasks = [asyncio.ensure_future(_fetch_limited(session, n, u, p)) for n, (u, p) in sources.items()]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
+
+# ---------- fetch & merge ----------
+def _parse_volumes(data):
     volumes = {}
-    for r in (vols.get("data", {}).get("pools") or []):
+    for r in (data.get("data", {}).get("pools") or []):
         addr = (r.get("address") or "").lower()
         if addr:
             volumes[addr] = float(r.get("volumeUSD") or 0)
+    return volumes
 
-    # 2) базовые APY
-    apys = await _get_json(session, f"{API}/getBaseApys/{chain}")
+def _parse_base_apys(data):
     base_apy = {}
-    for r in (apys.get("data", {}).get("baseApys") or []):
+    for r in (data.get("data", {}).get("baseApys") or []):
         addr = (r.get("address") or "").lower()
         if addr:
             # берем weekly, если есть, иначе daily
@@ -142,52 +544,1260 @@ async def fetch_chain_snapshot(session: aiohttp.ClientSession, chain: str):
             if ap is None:
                 ap = r.get("latestDailyApyPcent")
             base_apy[addr] = float(ap or 0)
+    return base_apy
+
+class PoolInfo:
+    """Пул из /getPools — только те поля, что нужны боту."""
+    __slots__ = ("address", "name", "tvl", "crv_apr", "url")
+
+    def __init__(self, address, name, tvl, crv_apr, url):
+        self.address = address   # как в API (регистр сохраняем для ссылки)
+        self.name = name
+        self.tvl = tvl
+        self.crv_apr = crv_apr
+        self.url = url           # dex-ссылка из poolUrls или None
+
+def _parse_pools(data):
+    pools = {}
+    for p in (data.get("data", {}).get("poolData") or []):
+        addr = (p.get("address") or "").lower()
+        if not addr:
+            continue
+        # CRV APR (в API это массив [min,max]; возьмём max)
+        crv_arr = p.get("gaugeCrvApy") or []
+        if isinstance(crv_arr, list) and crv_arr:
+            crv = max([float(x or 0) for x in crv_arr])
+        else:
+            crv = 0.0
+        pools[addr] = PoolInfo(
+            p.get("address"),
+            p.get("name") or p.get("symbol"),
+            float(p.get("usdTotal") or 0),
+            crv,
+            _dex_url(p.get("poolUrls")),
+        )
+    return pools
+
+# ---------- snapshot ----------
+SORT_COLUMNS = {"volume": "volume", "tvl": "tvl", "apy": "base_apy", "rewards": "rewards_apr"}
 
-    # 3) справочник пулов по всем реестрам (TVL, имя, ссылки, CRV APR)
-    pools_by_addr = {}
+class ChainSnapshot:
+    """
+    Снапшот сети в колонках: параллельные массивы вместо списка dict'ов.
+    Числа лежат в array('d'), строки — в списках; dict строки собирается
+    только для пулов, попавших в вывод (row / top_rows).
+    После сборки finish() строит по убывающему индексу на каждый ключ
+    сортировки, так что top — это просто срез.
+    version уникален для каждого снапшота — по нему кэшируется вывод.
+    """
+    __slots__ = ("chain", "version", "ts", "address", "name", "link",
+                 "tvl", "volume", "base_apy", "rewards_apr", "order", "_pos")
+    _versions = itertools.count(1)
+
+    def __init__(self, chain: str, ts: float = None):
+        self.chain = chain
+        self.version = next(ChainSnapshot._versions)
+        self.ts = time.time() if ts is None else ts   # когда собран (unix time)
+        self.address, self.name, self.link = [], [], []
+        self.tvl, self.volume = array("d"), array("d")
+        self.base_apy, self.rewards_apr = array("d"), array("d")
+        self.order = {}   # sort_key -> array('I') номеров строк по убыванию
+        self._pos = None  # адрес -> номер строки, строится по требованию
+
+    def __len__(self):
+        return len(self.address)
+
+    def append(self, address, name, link, tvl, volume, base_apy, rewards_apr):
+        self.address.append(address)
+        self.name.append(name)
+        self.link.append(link)
+        self.tvl.append(tvl)
+        self.volume.append(volume)
+        self.base_apy.append(base_apy)
+        self.rewards_apr.append(rewards_apr)
+
+    def row(self, i: int):
+        return {
+            "address": self.address[i],
+            "name": self.name[i],
+            "tvl": self.tvl[i],
+            "volume": self.volume[i],
+            "baseApy": self.base_apy[i],        # уже в процентах (из API)
+            "rewardsApr": self.rewards_apr[i],  # пока только CRV
+            "link": self.link[i],
+        }
+
+    def finish(self):
+        # sorted стабилен: при равных значениях порядок как у строк
+        for key, name in SORT_COLUMNS.items():
+            col = getattr(self, name)
+            self.order[key] = array("I", sorted(range(len(col)), key=col.__getitem__, reverse=True))
+        return self
+
+    def to_blobs(self):
+        # строки — orjson, числа — сырые array('d') подряд (tvl, volume, base_apy, rewards_apr)
+        strings = orjson.dumps([self.address, self.name, self.link])
+        numbers = b"".join(a.tobytes() for a in (self.tvl, self.volume, self.base_apy, self.rewards_apr))
+        return strings, numbers
+
+    @classmethod
+    def from_blobs(cls, chain: str, ts: float, strings: bytes, numbers: bytes):
+        snap = cls(chain, ts)
+        snap.address, snap.name, snap.link = orjson.loads(strings)
+        n = len(snap.address)
+        nums = array("d")
+        nums.frombytes(numbers)
+        snap.tvl, snap.volume = nums[:n], nums[n:2 * n]
+        snap.base_apy, snap.rewards_apr = nums[2 * n:3 * n], nums[3 * n:]
+        return snap.finish()
+
+    def ranked(self, sort_key: str):
+        key = sort_key if sort_key in SORT_COLUMNS else "volume"
+        if key not in self.order:
+            self.finish()
+        return self.order[key]
+
+    def top(self, sort_key: str, limit: int):
+        return self.ranked(sort_key)[:limit]
+
+    def top_rows(self, sort_key: str, limit: int):
+        return [self.row(i) for i in self.top(sort_key, limit)]
+
+    def positions(self):
+        if self._pos is None:
+            self._pos = {a: i for i, a in enumerate(self.address)}
+        return self._pos
+
+    def find(self, query: str):
+        """
+        Номер строки пула по адресу (полному или началу от 6 символов) или
+        по имени (точно, иначе единственное вхождение); None — не найден
+        или неоднозначно.
+        """
+        q = query.strip().lower()
+        if q.startswith("0x"):
+            i = self.positions().get(q)
+            if i is not None or len(q) < 8:
+                return i
+            hits = [i for i, a in enumerate(self.address) if a.startswith(q)]
+        else:
+            names = [n.lower() for n in self.name]
+            hits = [i for i, n in enumerate(names) if n == q] or [i for i, n in enumerate(names) if q in n]
+        return hits[0] if len(hits) == 1 else None
+
+_merge_state = {}   # chain -> последняя склейка (см. fetch_chain_snapshot)
+
+async def fetch_chain_snapshot(session: aiohttp.ClientSession, chain: str, errors: dict = None):
+    """
+    Собираем:
+      - TVL + имя + ссылки из /getPools/{registry}
+      - Volume из /getVolumes/{chain}
+      - Base vAPY из /getBaseApys/{chain}
+      - CRV APR из поля gaugeCrvApy в /getPools
+    Склейка по адресу пула (lowercase).
+    Все 11 запросов идут параллельно; упавшие источники попадают в errors
+    ({источник: текст ошибки}), если он передан, а вместо них берётся
+    прошлый удачный ответ (если его нет — источник пропускается).
+    Неизменившиеся источники не парсятся заново (см. fetch_source), а если
+    не поменялось ничего — возвращается тот же ChainSnapshot, что и в прошлый раз.
+    """
+    sources = {
+        "getVolumes": (f"{API}/getVolumes/{chain}", _parse_volumes),
+        "getBaseApys": (f"{API}/getBaseApys/{chain}", _parse_base_apys),
+    }
     for reg in REGISTRIES:
-        data = await _get_json(session, f"{API}/getPools/{chain}/{reg}")
-        for p in (data.get("data", {}).get("poolData") or []):
-            addr = (p.get("address") or "").lower()
-            if not addr:
-                continue
-            pools_by_addr.setdefault(addr, {})
-            pools_by_addr[addr].update({
-                "name": p.get("name") or p.get("symbol"),
-                "tvl": float(p.get("usdTotal") or 0),
-                "poolUrls": p.get("poolUrls") or {},
-                "address": p.get("address"),
-            })
-            # CRV APR (в API это массив [min,max]; возьмём max)
-            crv_arr = p.get("gaugeCrvApy") or []
-            if isinstance(crv_arr, list) and crv_arr:
-                pools_by_addr[addr]["crvApr"] = max([float(x or 0) for x in crv_arr])
-            else:
-                pools_by_addr[addr]["crvApr"] = 0.0
+        sources[f"getPools/{reg}"] = (f"{API}/getPools/{chain}/{reg}", _parse_pools)
+
+    # 1) объёмы и базовые APY (по адресу), 2) реестры — разбираем по мере прихода
+    volumes, base_apy, by_reg = {}, {}, {}
+    async for name, parsed, err in fetch_many(session, sources):
+        if err is not None and errors is not None:
+            errors[name] = err
+        if parsed is None:
+            continue
+        if name == "getVolumes":
+            volumes = parsed
+        elif name == "getBaseApys":
+            base_apy = parsed
+        else:
+            by_reg[name.split("/", 1)[1]] = parsed
+
+    return merge_chain(chain, volumes, base_apy, by_reg)
+
+def merge_chain(chain: str, volumes: dict, base_apy: dict, by_reg: dict):
+    # 3) справочник пулов по всем реестрам (TVL, имя, ссылки, CRV APR);
+    #    порядок REGISTRIES сохраняем — при дублях побеждает последний реестр.
+    #    Пересобираем только адреса из реестров, чей ответ поменялся.
+    t = time.perf_counter()
+    try:
+        snap = _merge(chain, volumes, base_apy, by_reg)
+    finally:
+        metrics.observe("curvebot_merge_seconds", time.perf_counter() - t, chain=chain)
+    metrics.set("curvebot_pools", len(_merge_state[chain]["pools"]), chain=chain)
+    metrics.set("curvebot_snapshot_rows", len(snap), chain=chain)
+    return snap
+
+def pool_link(chain: str, info: PoolInfo):
+    return info.url or f"https://curve.fi/#/{chain}/pool/{info.address or ''}"
+
+def _merge(chain: str, volumes: dict, base_apy: dict, by_reg: dict):
+    st = _merge_state.get(chain)
+    if st is None:
+        st = _merge_state[chain] = {"by_reg": {}, "pools": {}, "volumes": None, "base_apy": None,
+                                    "snap": ChainSnapshot(chain)}
+    old_by_reg, pools_by_addr = st["by_reg"], st["pools"]
+    changed = [reg for reg in REGISTRIES if by_reg.get(reg) is not old_by_reg.get(reg)]
+    # dict, а не set: адреса в порядке REGISTRIES — порядок pools_by_addr (и
+    # строк снапшота) не зависит от хэшей и одинаков от запуска к запуску
+    affected = {}
+    for reg in changed:
+        affected.update(dict.fromkeys(old_by_reg.get(reg) or ()))
+        affected.update(dict.fromkeys(by_reg.get(reg) or ()))
+    for addr in affected:
+        for reg in reversed(REGISTRIES):
+            info = (by_reg.get(reg) or {}).get(addr)
+            if info is not None:
+                pools_by_addr[addr] = info
+                break
+        else:
+            pools_by_addr.pop(addr, None)
+    st["by_reg"] = by_reg
+
+    if not changed and volumes is st["volumes"] and base_apy is st["base_apy"]:
+        return st["snap"]   # ничего не поменялось — тот же снапшот
+    st["volumes"], st["base_apy"] = volumes, base_apy
 
     # 4) финальная склейка
-    result = []
+    snap = ChainSnapshot(chain)
     for addr, info in pools_by_addr.items():
         v = volumes.get(addr, 0.0)
         apy = base_apy.get(addr, 0.0)
-        tvl = float(info.get("tvl") or 0)
-        crv = float(info.get("crvApr") or 0.0)
+        tvl = info.tvl
 
         if HIDE_ZERO and (tvl <= 0 or (abs(apy) < 1e-9 and v <= 1.0)):   # фильтр «нулевых»
             continue
         if tvl < MIN_TVL:
             continue
 
-        result.append({
-            "address": addr,
-            "name": info.get("name") or addr[:8],
-            "tvl": tvl,
-            "volume": v,
-            "baseApy": apy,            # уже в процентах (из API)
-            "rewardsApr": crv,         # пока только CRV; внешние инсентивы можно добавить из /getAllGauges
-            "link": pool_link(chain, info),
+        # rewards пока только CRV; внешние инсентивы можно добавить из /getAllGauges
+        snap.append(addr, info.name or addr[:8], pool_link(chain, info), tvl, v, apy, info.crv_apr)
+    st["snap"] = snap.finish()
+    return snap
+
+# ---------- snapshot store ----------
+class SnapshotStore:
+    """
+    Снапшоты на диске (SQLite), чтобы после рестарта сразу было что показать.
+    Все обращения к базе идут в одном отдельном потоке — event loop не ждёт
+    диск, а соединение не делится между потоками. Хранится не больше keep
+    последних снапшотов на сеть и не старше max_age_h часов.
+    """
+    def __init__(self, path: str, keep: int, max_age_h: float):
+        self.path = path
+        self.keep = max(keep, 1)
+        self.max_age = max_age_h * 3600
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-store")
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path)
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")   # действует только для новой базы
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " chain TEXT NOT NULL, saved_at REAL NOT NULL, rows INTEGER NOT NULL,"
+                " strings BLOB NOT NULL, numbers BLOB NOT NULL, PRIMARY KEY (chain, saved_at))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS watches ("
+                " id INTEGER PRIMARY KEY, chat_id TEXT NOT NULL, kind TEXT NOT NULL, chain TEXT NOT NULL,"
+                " address TEXT, name TEXT, threshold REAL NOT NULL, baseline REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS series ("
+                " chain TEXT PRIMARY KEY, saved_at REAL NOT NULL, meta BLOB NOT NULL, data BLOB NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def _save(self, chain: str, saved_at: float, n: int, strings: bytes, numbers: bytes):
+        db = self._conn()
+        with db:
+            db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                       (chain, saved_at, n, strings, numbers))
+            db.execute(
+                "DELETE FROM snapshots WHERE chain = ? AND saved_at NOT IN"
+                " (SELECT saved_at FROM snapshots WHERE chain = ? ORDER BY saved_at DESC LIMIT ?)",
+                (chain, chain, self.keep))
+            db.execute("DELETE FROM snapshots WHERE saved_at < ?", (saved_at - self.max_age,))
+        db.execute("PRAGMA incremental_vacuum")
+
+    def _load(self, chain: str):
+        row = self._conn().execute(
+            "SELECT saved_at, strings, numbers FROM snapshots WHERE chain = ? AND saved_at >= ?"
+            " ORDER BY saved_at DESC LIMIT 1", (chain, time.time() - self.max_age)).fetchone()
+        if row is None:
+            return None
+        saved_at, strings, numbers = row
+        return saved_at, ChainSnapshot.from_blobs(chain, saved_at, strings, numbers)
+
+    def save(self, snap: ChainSnapshot):
+        # сериализуем сразу (снапшот могут заменить), пишем в фоне
+        strings, numbers = snap.to_blobs()
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._pool, self._save, snap.chain, snap.ts, len(snap), strings, numbers)
+        fut.add_done_callback(_log_store_error)
+        return fut
+
+    async def load(self, chain: str):
+        """(saved_at, ChainSnapshot) последнего снапшота сети или None."""
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, self._load, chain)
+        except Exception as e:
+            print("store load error:", e)
+            return None
+
+    # подписки /watch: пишем в том же потоке, что и снапшоты
+    def _save_watch(self, row: tuple):
+        with self._conn() as db:
+            db.execute("INSERT OR REPLACE INTO watches VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _delete_watches(self, ids: list):
+        with self._conn() as db:
+            db.executemany("DELETE FROM watches WHERE id = ?", [(i,) for i in ids])
+
+    def _load_watches(self):
+        return self._conn().execute("SELECT * FROM watches ORDER BY id").fetchall()
+
+    def save_watch(self, row: tuple):
+        fut = asyncio.get_running_loop().run_in_executor(self._pool, self._save_watch, row)
+        fut.add_done_callback(_log_store_error)
+
+    def delete_watches(self, ids: list):
+        fut = asyncio.get_running_loop().run_in_executor(self._pool, self._delete_watches, list(ids))
+        fut.add_done_callback(_log_store_error)
+
+    async def load_watches(self):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, self._load_watches)
+        except Exception as e:
+            print("store load error:", e)
+            return []
+
+    # история метрик: одна строка на сеть, перезаписывается целиком
+    def _save_series(self, chain: str, saved_at: float, meta: bytes, data: bytes):
+        with self._conn() as db:
+            db.execute("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)", (chain, saved_at, meta, data))
+
+    def _load_series(self):
+        return self._conn().execute("SELECT chain, meta, data FROM series").fetchall()
+
+    def save_series(self, chain: str, meta: bytes, data: bytes):
+        fut = asyncio.get_running_loop().run_in_executor(
+            self._pool, self._save_series, chain, time.time(), meta, data)
+        fut.add_done_callback(_log_store_error)
+
+    async def load_series(self):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, self._load_series)
+        except Exception as e:
+            print("store load error:", e)
+            return []
+
+def _log_store_error(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        print("store save error:", fut.exception())
+
+store = SnapshotStore(STORE_PATH, STORE_KEEP, STORE_MAX_AGE_H) if STORE_PATH else None
+
+# ---------- snapshot cache ----------
+class SnapshotCache:
+    """
+    Кэш снапшотов по сети перед fetch_chain_snapshot.
+      - моложе ttl — отдаём как есть (hit);
+      - моложе max_stale — отдаём сразу, а обновляем в фоне (stale);
+      - иначе ждём свежую загрузку (miss).
+    Одновременные запросы к одной сети делят одну загрузку (single-flight).
+    С store: новые снапшоты сохраняются на диск, а при первом обращении к сети
+    после старта последний сохранённый отдаётся сразу как stale.
+    """
+    def __init__(self, ttl: float, max_stale: float, store: SnapshotStore = None):
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+        self.store = store
+        self.stats = {"hit": 0, "stale": 0, "miss": 0, "refresh": 0, "refresh_failed": 0, "restored": 0}
+        self._entries = {}    # chain -> {"ts", "snap", "errors"}
+        self._inflight = {}   # chain -> Task
+        self._restore = {}    # chain -> Task чтения из store (один раз на сеть)
+        self._failed = {}     # chain -> ошибки, если данных ещё нет вовсе
+        self.listeners = []   # fn(prev, snap) — на каждый новый снапшот сети
+
+    def age(self, chain: str):
+        e = self._entries.get(chain)
+        return None if e is None else time.monotonic() - e["ts"]
+
+    async def get(self, session, chain: str, errors: dict = None):
+        if self.store is not None and chain not in self._entries:
+            t = self._restore.get(chain)
+            if t is None:
+                t = self._restore[chain] = asyncio.ensure_future(self._restored(chain))
+            await asyncio.shield(t)
+        age = self.age(chain)
+        if age is not None and age < self.ttl:
+            self.stats["hit"] += 1
+        elif age is not None and age < self.max_stale:
+            self.stats["stale"] += 1
+            self.refresh(session, chain)
+        else:
+            self.stats["miss"] += 1
+            # shield: отмена одного ожидающего не должна рвать общую загрузку
+            await asyncio.shield(self.refresh(session, chain))
+        e = self._entries.get(chain) or {"snap": ChainSnapshot(chain), "errors": self._failed.get(chain, {})}
+        if errors is not None:
+            errors.update(e["errors"])
+        return e["snap"]
+
+    def refresh(self, session, chain: str):
+        t = self._inflight.get(chain)
+        if t is None:
+            t = self._inflight[chain] = asyncio.ensure_future(self._load(session, chain))
+            t.add_done_callback(lambda _t, ch=chain: self._inflight.pop(ch, None))
+        return t
+
+    async def _restored(self, chain: str):
+        got = await self.store.load(chain)
+        if got is None or chain in self._entries:
+            return
+        saved_at, snap = got
+        self.stats["restored"] += 1
+        # возраст с диска, но не старше max_stale — чтобы отдать сразу, а не ждать
+        age = min(max(time.time() - saved_at, self.ttl), self.max_stale - 1)
+        self._entries[chain] = {"ts": time.monotonic() - age, "snap": snap, "errors": {}}
+
+    async def _load(self, session, chain: str):
+        self.stats["refresh"] += 1
+        errors = {}
+        try:
+            snap = await fetch_chain_snapshot(session, chain, errors)
+        except Exception as e:
+            snap, errors = ChainSnapshot(chain), {"snapshot": str(e) or e.__class__.__name__}
+        if not snap and errors:
+            # всё упало — оставляем прошлые данные, свежесть не продлеваем; если
+            # данных нет вовсе, пустой снапшот не кэшируем и никому не отдаём —
+            # следующий get снова пойдёт в API
+            self.stats["refresh_failed"] += 1
+            if chain in self._entries:
+                self._entries[chain]["errors"] = errors
+            else:
+                self._failed[chain] = errors
+            return
+        self._failed.pop(chain, None)
+        prev = self._entries.get(chain)
+        self._entries[chain] = {"ts": time.monotonic(), "snap": snap, "errors": errors}
+        if prev is None or prev["snap"] is not snap:
+            if self.store is not None and snap:
+                self.store.save(snap)
+            for fn in self.listeners:
+                try:
+                    fn(prev and prev["snap"], snap)
+                except Exception as e:
+                    print("snapshot listener error:", e)
+
+    def errors(self, chain: str):
+        e = self._entries.get(chain)
+        return e["errors"] if e else self._failed.get(chain, {})
+
+    def listed(self, chain: str):
+        # пулы реестров до фильтров таблицы: {реестр: {addr: PoolInfo}} в порядке REGISTRIES;
+        # None — реестры в этом процессе ещё не загружались (напр. снапшот только с диска)
+        st = _merge_state.get(chain)
+        if st is None:
+            return None
+        return {reg: st["by_reg"][reg] for reg in REGISTRIES if reg in st["by_reg"]}
+
+# ---------- shared snapshots ----------
+# Файл снапшота (ROLE=collector пишет, ROLE=responder отображает в память):
+#   заголовок <8sQdI4x: magic, version, ts, n
+#   4 × n float64   — tvl, volume, base_apy, rewards_apr
+#   k × n uint32    — индексы сортировки, k = len(SORT_COLUMNS), в порядке SORT_COLUMNS
+#   3n+1 uint32     — смещения строк: address[0..n), name[0..n), link[0..n)
+#   utf-8 строки подряд
+# Файл после публикации не меняется; новый снапшот — новый файл, а
+# {chain}.json (manifest) атомарно переключается на него. Рядом — .pools
+# (orjson {реестр: {addr: [address, name, tvl, crv_apr, url]}}): пулы
+# реестров до фильтров таблицы, для /watch на ответчиках.
+SNAP_MAGIC = b"CURVSNP1"
+SNAP_HEADER = struct.Struct("<8sQdI4x")
+
+def write_snapshot_file(path: str, snap: ChainSnapshot):
+    n = len(snap)
+    cols = (snap.address, snap.name, snap.link)
+    encoded = [x.encode() for col in cols for x in col]
+    offsets = array("I", [0]) * (3 * n + 1)
+    pos = 0
+    for k, b in enumerate(encoded):
+        pos += len(b)
+        offsets[k + 1] = pos
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(SNAP_HEADER.pack(SNAP_MAGIC, snap.version, snap.ts, n))
+        for a in (snap.tvl, snap.volume, snap.base_apy, snap.rewards_apr):
+            fh.write(a.tobytes())
+        for key in SORT_COLUMNS:
+            fh.write(array("I", snap.ranked(key)).tobytes())
+        fh.write(offsets.tobytes())
+        fh.write(b"".join(encoded))
+    os.replace(tmp, path)
+
+class MappedStrings:
+    """Строковая колонка в mmap: строка декодируется только при обращении."""
+    __slots__ = ("blob", "offsets", "base", "n")
+
+    def __init__(self, blob, offsets, base: int, n: int):
+        self.blob, self.offsets, self.base, self.n = blob, offsets, base, n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        k = self.base + i
+        return str(self.blob[self.offsets[k]:self.offsets[k + 1]], "utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(self.n))
+
+class MappedSnapshot(ChainSnapshot):
+    """
+    ChainSnapshot поверх mmap-файла коллектора без копирования: колонки —
+    memoryview.cast('d'), индексы сортировки — cast('I'). Только для чтения;
+    файл остаётся отображённым, пока жив снапшот (даже если его уже удалили).
+    """
+    __slots__ = ("_mm",)
+
+    @classmethod
+    def attach(cls, chain: str, path: str):
+        with open(path, "rb") as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(mm)
+        magic, _, ts, n = SNAP_HEADER.unpack_from(mv)
+        if magic != SNAP_MAGIC:
+            raise ValueError(f"not a snapshot file: {path}")
+        snap = cls(chain, ts)
+        snap._mm = mm
+        pos = SNAP_HEADER.size
+        nums = []
+        for _ in range(4):
+            nums.append(mv[pos:pos + 8 * n].cast("d"))
+            pos += 8 * n
+        snap.tvl, snap.volume, snap.base_apy, snap.rewards_apr = nums
+        for key in SORT_COLUMNS:
+            snap.order[key] = mv[pos:pos + 4 * n].cast("I")
+            pos += 4 * n
+        offsets = mv[pos:pos + 4 * (3 * n + 1)].cast("I")
+        blob = mv[pos + 4 * (3 * n + 1):]
+        snap.address, snap.name, snap.link = (MappedStrings(blob, offsets, k * n, n) for k in range(3))
+        return snap
+
+class SnapshotPublisher:
+    """
+    Коллектор: каждый новый снапшот сети — в новый файл {chain}.{run}.{version}.snap
+    (run — случайный на запуск, версии после рестарта начинаются заново)
+    и .pools рядом, затем атомарная замена {chain}.json. Хранит keep последних файлов на сеть:
+    ответчик, который ещё держит старый, дочитает его из своего отображения.
+    Обновление без изменений (verify) переписывает только manifest — поле
+    verified, по нему ответчики считают возраст данных.
+    """
+    def __init__(self, path: str, keep: int = 3):
+        self.path, self.keep = path, max(keep, 2)
+        self.run = secrets.token_hex(4)
+        self.stats = {"published": 0, "verified": 0, "bytes": 0, "orphans_removed": 0}
+        self._files = collections.defaultdict(collections.deque)   # chain -> (.snap, .pools) по порядку публикации
+        self._last = {}                                             # chain -> опубликованный снапшот
+        self._manifests = {}                                        # chain -> содержимое {chain}.json
+        os.makedirs(path, exist_ok=True)
+        self._adopt()
+
+    def _adopt(self):
+        # после рестарта: файлы, на которые указывают manifest'ы, ещё читают
+        # ответчики — берём их в ротацию; остальные (прошлые запуски, .tmp) удаляем
+        names = os.listdir(self.path)
+        used = set()
+        for m in names:
+            if not m.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.path, m), "rb") as fh:
+                    files = orjson.loads(fh.read())
+                files = (files["file"], files.get("pools"))
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            self._files[m[:-len(".json")]].append(files)
+            used.update(files)
+        for name in names:
+            if name.endswith((".snap", ".pools", ".tmp")) and name not in used:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                    self.stats["orphans_removed"] += 1
+                except OSError:
+                    pass
+
+    def publish(self, snap: ChainSnapshot, errors: dict):
+        if self._last.get(snap.chain) is snap:
+            return
+        self._last[snap.chain] = snap
+        name = f"{snap.chain}.{self.run}.{snap.version}.snap"
+        path = os.path.join(self.path, name)
+        write_snapshot_file(path, snap)
+        pools = self._write_pools(snap, name[:-len(".snap")] + ".pools")
+        self._manifests[snap.chain] = {"file": name, "pools": pools, "ts": snap.ts, "verified": snap.ts,
+                                       "published": time.time(), "errors": errors or {}}
+        self._write_manifest(snap.chain)
+        self.stats["published"] += 1
+        self.stats["bytes"] += os.path.getsize(path)
+        files = self._files[snap.chain]
+        files.append((name, pools))
+        while len(files) > self.keep:
+            for old in files.popleft():
+                try:
+                    if old:
+                        os.remove(os.path.join(self.path, old))
+                except OSError:
+                    pass
+
+    def verify(self, chain: str, at: float, errors: dict):
+        # обновление подтвердило опубликованные данные: at — когда (unix time)
+        m = self._manifests.get(chain)
+        if m is None or at <= max(m["verified"], m["published"]):
+            return   # новый снапшот этого же обновления уже опубликован
+        m.update(verified=at, errors=errors or {})
+        self._write_manifest(chain)
+        self.stats["verified"] += 1
+
+    def _write_manifest(self, chain: str):
+        manifest = os.path.join(self.path, f"{chain}.json")
+        with open(manifest + ".tmp", "wb") as fh:
+            fh.write(orjson.dumps(self._manifests[chain]))
+        os.replace(manifest + ".tmp", manifest)
+
+    def _write_pools(self, snap: ChainSnapshot, name: str):
+        listed = snapshots.listed(snap.chain)
+        if listed is None:
+            return None
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(orjson.dumps({reg: {a: [i.address, i.name, i.tvl, i.crv_apr, i.url] for a, i in pools.items()}
+                                   for reg, pools in listed.items()}))
+        os.replace(path + ".tmp", path)
+        return name
+
+    def on_snapshot(self, prev, snap: ChainSnapshot):
+        self.publish(snap, snapshots.errors(snap.chain))
+
+class SharedSnapshots:
+    """
+    Ответчик: тот же интерфейс, что у SnapshotCache (get / refresh / age /
+    stats / listeners), но данные только от коллектора. На каждый get —
+    stat() manifest'а; поменялся (другой inode или mtime) — перечитываем его
+    и, если сменился файл, отображаем новый. Возраст данных — от verified:
+    коллектор обновляет его, даже когда данные не поменялись. В Curve API
+    ответчик не ходит, так что их можно запускать сколько угодно.
+    """
+    def __init__(self, path: str, max_stale: float):
+        self.path, self.max_stale = path, max_stale
+        self.stats = {"hit": 0, "stale": 0, "miss": 0, "refresh": 0, "refresh_failed": 0, "restored": 0}
+        self.listeners = []
+        self._entries = {}   # chain -> {"stat", "file", "pools", "verified", "snap", "errors", "listed"}
+
+    def _check(self, chain: str):
+        manifest = os.path.join(self.path, f"{chain}.json")
+        e = self._entries.get(chain)
+        try:
+            st = os.stat(manifest)
+            # manifest меняется через os.replace — новый inode; mtime одного
+            # не хватает: у двух быстрых записей он может совпасть
+            stat = (st.st_ino, st.st_mtime_ns)
+            if e is not None and e["stat"] == stat:
+                return e
+            with open(manifest, "rb") as fh:
+                m = orjson.loads(fh.read())
+            verified = m.get("verified", m["ts"])
+            if e is not None and e["file"] == m["file"]:
+                e.update(stat=stat, verified=verified, errors=m["errors"])
+                return e
+            snap = MappedSnapshot.attach(chain, os.path.join(self.path, m["file"]))
+        except FileNotFoundError:
+            return e
+        except (OSError, ValueError) as err:
+            self.stats["refresh_failed"] += 1
+            print("shared snapshot error:", chain, err)
+            return e
+        self.stats["refresh"] += 1
+        self._entries[chain] = {"stat": stat, "file": m["file"], "pools": m.get("pools"), "verified": verified,
+                                "snap": snap, "errors": m["errors"], "listed": None}
+        for fn in self.listeners:
+            try:
+                fn(e and e["snap"], snap)
+            except Exception as err:
+                print("snapshot listener error:", err)
+        return self._entries[chain]
+
+    def age(self, chain: str):
+        e = self._entries.get(chain)
+        return None if e is None else time.time() - e["verified"]
+
+    def errors(self, chain: str):
+        e = self._entries.get(chain)
+        return e["errors"] if e else {}
+
+    def listed(self, chain: str):
+        # .pools читаем лениво — он нужен только сетям с подписками /watch
+        e = self._entries.get(chain)
+        if e is None or not e["pools"]:
+            return None
+        if e["listed"] is None:
+            try:
+                with open(os.path.join(self.path, e["pools"]), "rb") as fh:
+                    raw = orjson.loads(fh.read())
+            except (OSError, ValueError) as err:
+                print("shared snapshot error:", chain, err)
+                return None
+            e["listed"] = {reg: {a: PoolInfo(*f) for a, f in pools.items()} for reg, pools in raw.items()}
+        return e["listed"]
+
+    async def get(self, session, chain: str, errors: dict = None):
+        e = self._check(chain)
+        if e is None:
+            self.stats["miss"] += 1
+            if errors is not None:
+                errors["collector"] = "no snapshot published yet"
+            return ChainSnapshot(chain)
+        self.stats["stale" if self.age(chain) > self.max_stale else "hit"] += 1
+        if errors is not None:
+            errors.update(e["errors"])
+        return e["snap"]
+
+    async def refresh(self, session, chain: str):
+        self._check(chain)
+
+if ROLE == "responder":
+    snapshots = SharedSnapshots(SHM_DIR, SNAPSHOT_MAX_STALE)
+else:
+    snapshots = SnapshotCache(SNAPSHOT_TTL, SNAPSHOT_MAX_STALE, store)
+
+metrics.collector("cache", lambda: [("counter", "curvebot_snapshot_cache_total", {"result": k}, v)
+                           for k, v in snapshots.stats.items()] + [
+    ("counter", "curvebot_source_total", {"result": k}, v) for k, v in source_stats.items()] + [
+    ("gauge", "curvebot_snapshot_age_seconds", {"chain": ch}, snapshots.age(ch))
+    for ch in CHAINS if snapshots.age(ch) is not None] + [
+    ("gauge", "curvebot_breakers_open", {}, sum(b.is_open() for b in _breakers.values()))])
+
+async def warm_loop(session):
+    # держим свежими все CHAINS (CACHE_WARM) или хотя бы сети с подписками /watch —
+    # иначе подпискам нечего сравнивать, пока никто не спрашивает таблицу
+    period = max(SNAPSHOT_TTL * 0.8, 1)
+    while True:
+        chains = CHAINS if CACHE_WARM else sorted(watches.chains())
+        await asyncio.gather(*(snapshots.refresh(session, ch) for ch in chains), return_exceptions=True)
+        await asyncio.sleep(period)
+
+# ---------- watches ----------
+class SnapshotDiff:
+    """
+    Разница двух снапшотов сети по адресам: added — номера строк в cur,
+    removed — номера строк в prev, changed — пары (строка prev, строка cur)
+    с изменившимся TVL или base APY.
+    """
+    __slots__ = ("prev", "cur", "added", "removed", "changed")
+
+    def __init__(self, prev: ChainSnapshot, cur: ChainSnapshot):
+        self.prev, self.cur = prev, cur
+        pos = prev.positions()
+        p_tvl, p_apy, c_tvl, c_apy = prev.tvl, prev.base_apy, cur.tvl, cur.base_apy
+        self.added, self.changed = [], []
+        matched = 0
+        for j, addr in enumerate(cur.address):
+            i = pos.get(addr)
+            if i is None:
+                self.added.append(j)
+                continue
+            matched += 1
+            if c_tvl[j] != p_tvl[i] or c_apy[j] != p_apy[i]:
+                self.changed.append((i, j))
+        if matched == len(prev):
+            self.removed = []
+        else:
+            cur_pos = cur.positions()
+            self.removed = [i for i, a in enumerate(prev.address) if a not in cur_pos]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+class Watch:
+    """
+    Подписка чата:
+      tvl — TVL пула упал на threshold % от baseline (после срабатывания
+            baseline сдвигается на текущее значение);
+      apy — base APY пула поднялся выше threshold %;
+      new — в реестрах сети появился пул с TVL от threshold.
+    """
+    __slots__ = ("id", "chat_id", "kind", "chain", "address", "name", "threshold", "baseline")
+
+    def __init__(self, id, chat_id, kind, chain, address, name, threshold, baseline):
+        self.id, self.chat_id, self.kind, self.chain = id, chat_id, kind, chain
+        self.address, self.name, self.threshold, self.baseline = address, name, threshold, baseline
+
+    def as_row(self):
+        return (self.id, str(self.chat_id), self.kind, self.chain, self.address, self.name,
+                self.threshold, self.baseline)
+
+    def describe(self):
+        if self.kind == "tvl":
+            return f"#{self.id} {self.chain} {self.name}: TVL −{self.threshold:g}% (from {usd_short(self.baseline)})"
+        if self.kind == "apy":
+            return f"#{self.id} {self.chain} {self.name}: base APY > {self.threshold:g}%"
+        return f"#{self.id} {self.chain}: new pool ≥ {usd_short(self.threshold)}"
+
+class WatchRegistry:
+    """
+    Подписки с индексами по (сеть, адрес) и по сети для «new». На новый
+    снапшот считается SnapshotDiff и проверяются только подписки на пулы
+    из diff — цена растёт с числом изменений, а не подписки × пулы.
+    Появление и исчезновение пулов смотрим по реестрам (snapshots.listed),
+    а не по таблице: пул, который просто вышел из-под MIN_TVL / HIDE_ZERO
+    или вернулся в таблицу, новым или удалённым не считается.
+    Сработавшие уведомления копятся по чату batch_s секунд и уходят одним
+    сообщением через outbox.
+    """
+    def __init__(self, store: SnapshotStore = None, batch_s: float = 3.0):
+        self.store = store
+        self.batch_s = batch_s
+        self.stats = {"diffs": 0, "checked": 0, "fired": 0, "messages": 0}
+        self._watches = {}                             # id -> Watch
+        self._by_addr = collections.defaultdict(dict)  # (chain, addr) -> {id: Watch}
+        self._new = collections.defaultdict(dict)      # chain -> {id: Watch}
+        self._ids = itertools.count(1)
+        self._pending = {}                             # chat_id -> [строки уведомлений]
+        self._flush = {}                               # chat_id -> Task отправки
+        self._seen = collections.defaultdict(set)      # chain -> адреса, хоть раз бывшие в реестрах
+        self._regs = collections.defaultdict(dict)     # chain -> {реестр: последний просмотренный ответ}
+
+    async def load(self):
+        if self.store is None:
+            return
+        for row in await self.store.load_watches():
+            id_, chat, kind, chain, address, name, threshold, baseline = row
+            chat = int(chat) if chat.lstrip("-").isdigit() else chat
+            self._index(Watch(id_, chat, kind, chain, address, name, threshold, baseline))
+        self._ids = itertools.count(max(self._watches, default=0) + 1)
+
+    def _index(self, w: Watch):
+        self._watches[w.id] = w
+        if w.kind == "new":
+            self._new[w.chain][w.id] = w
+        else:
+            self._by_addr[(w.chain, w.address)][w.id] = w
+
+    def chains(self):
+        return {w.chain for w in self._watches.values()}
+
+    def of_chat(self, chat_id):
+        return [w for w in self._watches.values() if w.chat_id == chat_id]
+
+    def add(self, chat_id, kind, chain, threshold, address=None, name=None, baseline=None):
+        w = Watch(next(self._ids), chat_id, kind, chain, address, name, threshold, baseline)
+        self._index(w)
+        if self.store is not None:
+            self.store.save_watch(w.as_row())
+        return w
+
+    def remove(self, chat_id, ids=None):
+        gone = [w for w in self.of_chat(chat_id) if ids is None or w.id in ids]
+        for w in gone:
+            del self._watches[w.id]
+            index = self._new[w.chain] if w.kind == "new" else self._by_addr[(w.chain, w.address)]
+            index.pop(w.id, None)
+        for chain in {w.chain for w in gone} - self.chains():
+            # сеть больше не отслеживается — при новой подписке реестры запомним заново
+            self._seen.pop(chain, None)
+            self._regs.pop(chain, None)
+        if gone and self.store is not None:
+            self.store.delete_watches([w.id for w in gone])
+        return gone
+
+    def on_snapshot(self, prev: ChainSnapshot, cur: ChainSnapshot):
+        chain = cur.chain
+        if chain not in self.chains():
+            return
+        listed = snapshots.listed(chain)
+        if listed is not None:
+            for info in self._listings(chain, listed):
+                for w in self._new.get(chain, {}).values():
+                    self.stats["checked"] += 1
+                    if info.tvl >= w.threshold:
+                        self._fire(w, f"🆕 {chain}: {info.name or info.address} • TVL {usd_short(info.tvl)} • "
+                                      f"{pool_link(chain, info)}")
+        if prev is None or not prev or not cur:
+            return
+        diff = SnapshotDiff(prev, cur)
+        self.stats["diffs"] += 1
+        if not diff:
+            return
+        for i, j in diff.changed:
+            self._check_pool(chain, cur.address[j], prev, i, cur, j)
+        for j in diff.added:
+            self._check_pool(chain, cur.address[j], None, None, cur, j)
+        for i in diff.removed:
+            ws = self._by_addr.get((chain, prev.address[i]))
+            if ws and listed is not None:   # без реестров не отличить фильтр таблицы от делистинга
+                self._check_removed(chain, prev, i, list(ws.values()), listed)
+
+    def _listings(self, chain, listed):
+        """
+        Пулы, впервые появившиеся в уже загружавшихся реестрах. Первый ответ
+        реестра (старт, сеть только что подписана, реестр наконец ответил)
+        только запоминает адреса — иначе он выглядел бы как сотни новых пулов.
+        """
+        seen, regs, fresh = self._seen[chain], self._regs[chain], []
+        for reg, pools in listed.items():
+            known = regs.get(reg)
+            if known is pools:
+                continue   # ответ реестра не менялся
+            regs[reg] = pools
+            if known is None:
+                seen.update(pools)
+                continue
+            for addr, info in pools.items():
+                if addr not in seen:
+                    seen.add(addr)
+                    fresh.append(info)
+        return fresh
+
+    def _check_removed(self, chain, prev, i, ws, listed):
+        # пул ушёл из таблицы: делистинг — если его нет ни в одном реестре,
+        # иначе обычная проверка TVL по значению из реестра
+        addr = prev.address[i]
+        info = next((pools[addr] for pools in reversed(listed.values()) if addr in pools), None)
+        for w in ws:
+            if w.kind != "tvl":
+                continue
+            self.stats["checked"] += 1
+            if info is None:
+                self._fire(w, f"📉 {chain}: {w.name} is no longer listed in Curve registries, "
+                              f"was {usd_short(prev.tvl[i])}")
+            else:
+                self._check_tvl(w, chain, info.name or w.name, info.tvl)
+
+    def _check_tvl(self, w: Watch, chain, name, now):
+        if w.baseline and now <= w.baseline * (1 - w.threshold / 100):
+            drop = (1 - now / w.baseline) * 100
+            self._fire(w, f"📉 {chain}: {name} TVL {usd_short(w.baseline)} → {usd_short(now)} (−{drop:.1f}%)")
+            w.baseline = now
+            if self.store is not None:
+                self.store.save_watch(w.as_row())
+
+    def _check_pool(self, chain, addr, prev, i, cur, j):
+        for w in list(self._by_addr.get((chain, addr), {}).values()):
+            self.stats["checked"] += 1
+            if w.kind == "tvl":
+                self._check_tvl(w, chain, cur.name[j], cur.tvl[j])
+            elif w.kind == "apy":
+                was = prev.base_apy[i] if prev is not None else None
+                now = cur.base_apy[j]
+                if now > w.threshold and (was is None or was <= w.threshold):
+                    self._fire(w, f"📈 {chain}: {cur.name[j]} base APY "
+                                  f"{pct(was) + ' → ' if was is not None else ''}{pct(now)} (above {w.threshold:g}%)")
+
+    def _fire(self, w: Watch, line: str):
+        self.stats["fired"] += 1
+        self._pending.setdefault(w.chat_id, []).append(line)
+        if w.chat_id not in self._flush:
+            self._flush[w.chat_id] = asyncio.ensure_future(self._send_later(w.chat_id))
+
+    async def _send_later(self, chat_id):
+        try:
+            await asyncio.sleep(self.batch_s)
+        finally:
+            self._flush.pop(chat_id, None)
+            lines = self._pending.pop(chat_id, [])
+        if lines:
+            self.stats["messages"] += 1
+            try:
+                await safe_send("\n".join(lines), md=False, chat_id=chat_id)
+            except Exception as e:
+                print("watch notify error:", e)
+
+watches = WatchRegistry(store, WATCH_BATCH_S)
+snapshots.listeners.append(watches.on_snapshot)
+metrics.collector("watches", lambda: [("counter", f"curvebot_watch_{k}_total", {}, v)
+                                      for k, v in watches.stats.items()] + [
+    ("gauge", "curvebot_watches", {}, len(watches._watches))])
+
+# ---------- series ----------
+SERIES_METRICS = ("tvl", "volume", "base_apy", "rewards_apr")   # колонки ChainSnapshot
+SPARK = "▁▂▃▄▅▆▇█"
+
+class SeriesTier:
+    """
+    Кольцо из n бакетов шириной width секунд. Значения лежат «по времени»:
+    values[m][pos * cap + slot] — так срез одного бакета по всем пулам
+    непрерывен (movers берёт два среза), а история пула — срез с шагом cap.
+    В бакете — среднее всех наблюдений за него; count == 0 — нет данных.
+    """
+    __slots__ = ("width", "n", "cap", "bucket", "count", "values", "last")
+
+    def __init__(self, width: int, n: int, cap: int):
+        self.width, self.n, self.cap = width, n, cap
+        self.bucket = array("q", [-1]) * n            # номер бакета (ts // width) в позиции
+        self.count = array("H", bytes(2 * n * cap))
+        self.values = {m: array("f", bytes(4 * n * cap)) for m in SERIES_METRICS}
+        self.last = -1                                # последний записанный бакет
+
+    def add(self, ts: float, slots, cols: dict):
+        b = int(ts // self.width)
+        pos = b % self.n
+        lo = pos * self.cap
+        if self.bucket[pos] != b:
+            # кольцо дошло до старого бакета — освобождаем его целиком
+            self.bucket[pos] = b
+            self.count[lo:lo + self.cap] = array("H", bytes(2 * self.cap))
+        count = self.count
+        for m, col in cols.items():
+            vals = self.values[m]
+            for s, x in zip(slots, col):
+                i = lo + s
+                c = count[i]
+                vals[i] = x if c == 0 else vals[i] + (x - vals[i]) / (c + 1)
+        for s in slots:
+            if count[lo + s] < 0xFFFF:
+                count[lo + s] += 1
+        self.last = max(self.last, b)
+
+    def clear_slot(self, slot: int):
+        self.count[slot::self.cap] = array("H", bytes(2 * self.n))
+
+    def column(self, b: int, metric: str):
+        # (count, values) всех слотов за бакет b или None, если его уже/ещё нет
+        pos = b % self.n
+        if b < 0 or self.bucket[pos] != b:
+            return None
+        lo = pos * self.cap
+        return self.count[lo:lo + self.cap], self.values[metric][lo:lo + self.cap]
+
+    def history(self, slot: int, metric: str, first: int):
+        # значения слота по бакетам first..last (None — нет данных)
+        out, vals = [], self.values[metric]
+        for b in range(max(first, self.last - self.n + 1), self.last + 1):
+            i = (b % self.n) * self.cap + slot
+            out.append(vals[i] if self.bucket[b % self.n] == b and self.count[i] else None)
+        return out
+
+class ChainSeries:
+    """
+    История метрик пулов одной сети фиксированного размера: cap слотов под
+    адреса, для каждого яруса SERIES_TIERS — своё кольцо. Один снапшот
+    пишется во все ярусы сразу, грубые ярусы усредняют его сами.
+    """
+    def __init__(self, chain: str, cap: int, tiers):
+        self.chain, self.cap = chain, cap
+        self.tiers = [SeriesTier(w, n, cap) for w, n in sorted(tiers)]
+        self.slot = {}                   # адрес -> слот
+        self.address = [None] * cap
+        self.name = [""] * cap
+        self.seen = array("d", bytes(8 * cap))   # когда пул был в снапшоте последний раз
+        self.saved = time.monotonic()
+
+    def _evictable(self, ts: float):
+        # слоты пулов, которых нет в текущем снапшоте, — давно не виденные первыми
+        return iter(sorted((s for s in range(self.cap) if self.seen[s] < ts), key=self.seen.__getitem__))
+
+    def record(self, snap: ChainSnapshot):
+        ts = snap.ts
+        slots, rows, fresh = [], [], []
+        for i, addr in enumerate(snap.address):
+            s = self.slot.get(addr)
+            if s is None:
+                fresh.append(i)
+                continue
+            slots.append(s)
+            rows.append(i)
+            self.seen[s] = ts
+        evict = None
+        for i in fresh:
+            addr = snap.address[i]
+            if len(self.slot) < self.cap:
+                s = len(self.slot)
+            else:
+                # мест нет — вытесняем пул, которого дольше всех не было в снапшотах
+                evict = evict or self._evictable(ts)
+                s = next(evict, None)
+                if s is None:
+                    break
+                del self.slot[self.address[s]]
+                for t in self.tiers:
+                    t.clear_slot(s)
+            self.slot[addr] = s
+            self.address[s] = addr
+            self.seen[s] = ts
+            slots.append(s)
+            rows.append(i)
+        for s, i in zip(slots, rows):
+            self.name[s] = snap.name[i]
+        cols = {m: [getattr(snap, m)[i] for i in rows] for m in SERIES_METRICS}
+        for t in self.tiers:
+            t.add(ts, slots, cols)
+
+    def tier_for(self, window: float):
+        # самый подробный ярус, который помнит всё окно
+        for t in self.tiers:
+            if t.width * t.n >= window:
+                return t
+        return self.tiers[-1]
+
+    def movers(self, metric: str, window: float, limit: int):
+        """
+        [(слот, было, стало, изменение)] по убыванию |изменения| за окно:
+        для TVL и volume — в %, для APY — в процентных пунктах.
+        """
+        t = self.tier_for(window)
+        if t.last < 0:
+            return []
+        now = t.column(t.last, metric)
+        back = max(round(window / t.width), 1)
+        past = None
+        # первый сохранившийся бакет от начала окна и позже (пропуски — данные не менялись),
+        # так что при дырах в истории фактическое окно короче запрошенного
+        for b in range(t.last - back, t.last):
+            past = t.column(b, metric)
+            if past is not None:
+                break
+        if past is None:
+            return []
+        (nc, nv), (pc, pv) = now, past
+        relative = metric in ("tvl", "volume")
+        moves = [(s, p, v, ((v - p) / p * 100) if relative else v - p)
+                 for s, (c1, c0, v, p) in enumerate(zip(nc, pc, nv, pv))
+                 if c1 and c0 and (p > 0 or not relative)]
+        return heapq.nlargest(limit, moves, key=lambda m: abs(m[3]))
+
+    def trend(self, slot: int, metric: str, window: float):
+        # снапшот пишется только когда данные поменялись — пропуски тянем прошлым значением
+        t = self.tier_for(window)
+        points = t.history(slot, metric, t.last - max(round(window / t.width), 1) + 1)
+        while points and points[0] is None:   # до появления пула
+            points.pop(0)
+        for k in range(1, len(points)):
+            if points[k] is None:
+                points[k] = points[k - 1]
+        return points
+
+    def to_blobs(self):
+        meta = orjson.dumps({
+            "cap": self.cap, "address": self.address, "name": self.name,
+            "tiers": [[t.width, t.n, t.last] for t in self.tiers],
         })
-    return result
+        parts = [self.seen.tobytes()]
+        for t in self.tiers:
+            parts += [t.bucket.tobytes(), t.count.tobytes()] + [t.values[m].tobytes() for m in SERIES_METRICS]
+        return meta, b"".join(parts)
+
+    @classmethod
+    def from_blobs(cls, chain: str, meta: bytes, data: bytes):
+        m = orjson.loads(meta)
+        obj = cls(chain, m["cap"], [(w, n) for w, n, _ in m["tiers"]])
+        view = memoryview(data)
+        def take(arr):
+            nonlocal view
+            size = len(arr) * arr.itemsize
+            arr[:] = type(arr)(arr.typecode, view[:size].tobytes())
+            view = view[size:]
+        take(obj.seen)
+        for t, (_, _, last) in zip(obj.tiers, m["tiers"]):
+            take(t.bucket)
+            take(t.count)
+            for name in SERIES_METRICS:
+                take(t.values[name])
+            t.last = last
+        obj.address, obj.name = m["address"], m["name"]
+        obj.slot = {a: s for s, a in enumerate(obj.address) if a is not None}
+        return obj
+
+class SeriesStore:
+    """
+    Истории по сетям: пишутся на каждый новый снапшот (listener
+    SnapshotCache), раз в save_s сохраняются в store и поднимаются при старте.
+    Форма истории (cap, ярусы) поменялась — старая запись с диска пропускается.
+    """
+    def __init__(self, cap: int, tiers, store: SnapshotStore = None, save_s: float = 300):
+        self.cap, self.tiers = cap, [tuple(t) for t in tiers]
+        self.store, self.save_s = store, save_s
+        self.chains = {}   # chain -> ChainSeries
+
+    def get(self, chain: str):
+        return self.chains.get(chain)
+
+    def on_snapshot(self, prev: ChainSnapshot, snap: ChainSnapshot):
+        if not snap:
+            return
+        cs = self.chains.get(snap.chain)
+        if cs is None:
+            cs = self.chains[snap.chain] = ChainSeries(snap.chain, self.cap, self.tiers)
+        t = time.perf_counter()
+        cs.record(snap)
+        metrics.observe("curvebot_series_record_seconds", time.perf_counter() - t)
+        if self.store is not None and time.monotonic() - cs.saved >= self.save_s:
+            cs.saved = time.monotonic()
+            self.store.save_series(snap.chain, *cs.to_blobs())
+
+    async def load(self):
+        if self.store is None:
+            return
+        for chain, meta, data in await self.store.load_series():
+            try:
+                cs = ChainSeries.from_blobs(chain, meta, data)
+            except Exception as e:
+                print("series load error:", chain, e)
+                continue
+            if cs.cap == self.cap and [(t.width, t.n) for t in cs.tiers] == sorted(self.tiers):
+                self.chains.setdefault(chain, cs)
+
+series = SeriesStore(SERIES_POOLS, SERIES_TIERS, store, SERIES_SAVE_S)
+snapshots.listeners.append(series.on_snapshot)
+
+def parse_window(s: str):
+    # "90s", "30m", "6h", "2d" -> секунды; None, если не окно (в т.ч. inf, nan, <= 0)
+    s = (s or "").strip().lower()
+    mult = {"s": 1, "m": 60, "h": 3600, "d": 86400}.get(s[-1:])
+    try:
+        v = float(s[:-1]) * mult if mult else None
+    except ValueError:
+        return None
+    return v if v is not None and math.isfinite(v) and v > 0 else None
+
+def sparkline(points):
+    vals = [p for p in points if p is not None]
+    if not vals:
+        return ""
+    lo, hi = min(vals), max(vals)
+    span = (hi - lo) or 1.0
+    return "".join(" " if p is None else SPARK[min(int((p - lo) / span * len(SPARK)), len(SPARK) - 1)]
+                   for p in points)
+
+def resample(points, width: int):
+    # не шире width символов: соседние точки усредняются
+    if len(points) <= width:
+        return points
+    out, step = [], len(points) / width
+    for k in range(width):
+        chunk = [p for p in points[int(k * step):int((k + 1) * step)] if p is not None]
+        out.append(sum(chunk) / len(chunk) if chunk else None)
+    return out
 
 # ---------- presentation ----------
 def format_pool_block(p, rank=None):
@@ -207,21 +1817,56 @@ def format_pool_block(p, rank=None):
         f"🔗 {link}"
     )
 
-def format_chain_table(chain:str, rows, limit:int, sort_key:str):
-    keyf = {
-        "volume":  lambda x: float(x.get("volume") or 0),
-        "tvl":     lambda x: float(x.get("tvl") or 0),
-        "apy":     lambda x: float(x.get("baseApy") or 0),
-        "rewards": lambda x: float(x.get("rewardsApr") or 0),
-    }.get(sort_key, lambda x: float(x.get("volume") or 0))
-    rows = sorted(rows, key=keyf, reverse=True)[:limit]
+def merge_top(snaps, sort_key: str, limit: int):
+    """
+    Ленивый k-way merge готовых индексов нескольких сетей: [(snap, i), ...]
+    для первых limit строк. Дальше limit-й строки ничего не читается.
+    """
+    col = SORT_COLUMNS.get(sort_key, "volume")
+    streams = [zip(itertools.repeat(s), s.ranked(sort_key)) for s in snaps]
+    merged = heapq.merge(*streams, key=lambda t: getattr(t[0], col)[t[1]], reverse=True)
+    return list(itertools.islice(merged, limit))
+
+# готовые таблицы: (chain, sort, limit, версия снапшота) -> текст
+_rendered = collections.OrderedDict()
+render_stats = {"hit": 0, "miss": 0}
 
+def cached_render(key, render):
+    out = _rendered.get(key)
+    if out is not None:
+        _rendered.move_to_end(key)
+        render_stats["hit"] += 1
+        return out
+    render_stats["miss"] += 1
+    out = _rendered[key] = render()
+    if len(_rendered) > RENDER_CACHE_SIZE:
+        _rendered.popitem(last=False)
+    return out
+
+metrics.collector("render", lambda: [("counter", "curvebot_render_cache_total", {"result": k}, v)
+                           for k, v in render_stats.items()])
+
+def format_chain_table(chain:str, snap: ChainSnapshot, limit:int, sort_key:str):
+    return cached_render(
+        (chain, sort_key, limit, snap.version),
+        lambda: format_table(chain, snap.top_rows(sort_key, limit), sort_key, snap.ts))
+
+def format_table(chain: str, rows, sort_key: str, ts: float = None):
+    # rows уже отобраны и упорядочены; ts — время данных (по умолчанию сейчас)
+    t = time.perf_counter()
+    try:
+        return _format_table(chain, rows, sort_key, ts)
+    finally:
+        metrics.observe("curvebot_format_seconds", time.perf_counter() - t)
+
+def _format_table(chain: str, rows, sort_key: str, ts: float):
     if not rows:
         return "⚠️ По текущим фильтрам ничего не найдено."
 
     head = f"*{chain.title()} — Top {len(rows)} by {sort_key}*"
     blocks = [head] + [format_pool_block(p, i+1) for i, p in enumerate(rows)]
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    when = datetime.now(timezone.utc) if ts is None else datetime.fromtimestamp(ts, timezone.utc)
+    ts = when.strftime("%Y-%m-%d %H:%M UTC")
     blocks.append(f"_updated by curve-api v1 • {ts}_")
     return "\n\n".join(blocks)
 
@@ -237,41 +1882,725 @@ HELP = (
     "/tvl [limit] — top by TVL (default chain)\n"
     "/rewards [limit] — top by CRV rewards (default chain)\n"
     "/top <sort> all [limit] — cross-chain top (same sort keys)\n"
+    "/cache — snapshot cache counters\n"
+    "/watch tvl|apy|new … — alerts on pool changes (/watch for details)\n"
+    "/unwatch <id|all> — remove alerts\n"
+    "/movers <chain> [1h|6h|1d] [sort] — biggest changes over a window\n"
+    "/trend <chain> <pool> [6h|1d|7d] — sparklines for a pool\n"
+    "/stats, /profile on|off — latency and profiling (admins)\n"
 )
 
-async def safe_send(text: str, *, md: bool=True):
+# ---------- outbound ----------
+MAX_MESSAGE_LEN = 4096   # лимит Telegram (в UTF-16 символах)
+
+def _tg_len(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LEN):
+    """
+    Режем по границам блоков ("\n\n" — один пул), чтобы не рвать Markdown.
+    Блок длиннее лимита режется по строкам, строка — по символам.
+    """
+    if _tg_len(text) <= limit:
+        return [text]
+    parts, cur = [], ""
+    for block in text.split("\n\n"):
+        pieces = [block]
+        if _tg_len(block) > limit:
+            pieces = []
+            for line in block.split("\n"):
+                while _tg_len(line) > limit:
+                    pieces.append(line[:limit // 2])
+                    line = line[limit // 2:]
+                pieces.append(line)
+        for k, piece in enumerate(pieces):
+            sep = "\n\n" if k == 0 else "\n"
+            if cur and _tg_len(cur) + _tg_len(sep) + _tg_len(piece) > limit:
+                parts.append(cur)
+                cur = ""
+            cur = f"{cur}{sep}{piece}" if cur else piece
+    if cur:
+        parts.append(cur)
+    return parts
+
+class TokenBucket:
+    """rate токенов в секунду, запас до burst; block() — пауза после retry_after."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.ts = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def take(self):
+        async with self._lock:   # ждущие обслуживаются по очереди
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Outbox:
+    """
+    Исходящие сообщения: режет длинные тексты (split_message), держит темп
+    общим и per-chat token bucket'ом, на 429 ждёт retry_after и повторяет.
+    Одинаковое сообщение в тот же чат, пока первое в пути или отправлено
+    меньше dedup_s секунд назад, второй раз не уходит (неудачная отправка
+    не в счёт — её можно повторить сразу).
+    """
+    def __init__(self, global_rate: float, chat_rate: float, dedup_s: float):
+        self.chat_rate = chat_rate
+        self.dedup_s = dedup_s
+        self.stats = {"messages": 0, "parts": 0, "coalesced": 0, "retry_after": 0}
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}     # chat_id -> TokenBucket
+        self._pending = {}   # (chat, md, text) -> Task
+        self._recent = {}    # (chat, md, text) -> когда отправлено
+
+    def queued(self):
+        return len(self._pending)
+
+    async def send(self, chat_id, text: str, md: bool = True):
+        key = (str(chat_id), md, text)
+        now = time.monotonic()
+        task = self._pending.get(key)
+        if task is None and now - self._recent.get(key, -1e9) < self.dedup_s:
+            self.stats["coalesced"] += 1
+            return
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._send(chat_id, text, md))
+            task.add_done_callback(lambda t, k=key: self._sent(k, t))
+        else:
+            self.stats["coalesced"] += 1
+        await asyncio.shield(task)
+
+    def _sent(self, key, task):
+        self._pending.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        now = time.monotonic()
+        self._recent[key] = now
+        if len(self._recent) > 1024:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedup_s}
+
+    async def _send(self, chat_id, text: str, md: bool):
+        self.stats["messages"] += 1
+        for part in split_message(text):
+            chat_id = await self._send_part(chat_id, part, md)
+
+    async def _send_part(self, chat_id, text: str, md: bool):
+        while True:
+            bucket = self._chats.get(str(chat_id))
+            if bucket is None:
+                bucket = self._chats[str(chat_id)] = TokenBucket(self.chat_rate, 3)
+            await bucket.take()
+            await self._global.take()
+            t = time.perf_counter()
+            try:
+                self.stats["parts"] += 1
+                return await _send_raw(chat_id, text, md)
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                wait = e.retry_after
+                wait = wait.total_seconds() if isinstance(wait, timedelta) else float(wait)
+                # по 429 не видно, чатовый это лимит или общий на бота — ждут оба
+                bucket.block(wait)
+                self._global.block(wait)
+            finally:
+                metrics.observe("curvebot_send_seconds", time.perf_counter() - t)
+
+async def _send_raw(chat_id, text: str, md: bool):
+    # возвращает chat_id, куда реально ушло (после миграции группы — новый)
     global CHAT_ID
+    kw = {"parse_mode": constants.ParseMode.MARKDOWN} if md else {}
     try:
-        await bot.send_message(
-            CHAT_ID, text,
-            parse_mode=constants.ParseMode.MARKDOWN,
-            disable_web_page_preview=True
-        )
+        await bot.send_message(chat_id, text, disable_web_page_preview=True, **kw)
+        return chat_id
     except ChatMigrated as e:
-        CHAT_ID = str(e.new_chat_id)
-        await bot.send_message(
-            CHAT_ID, text,
-            parse_mode=constants.ParseMode.MARKDOWN,
-            disable_web_page_preview=True
-        )
+        if str(chat_id) == str(CHAT_ID):
+            CHAT_ID = str(e.new_chat_id)
+        await bot.send_message(e.new_chat_id, text, disable_web_page_preview=True, **kw)
+        return e.new_chat_id
+
+outbox = Outbox(SEND_RATE_GLOBAL, SEND_RATE_CHAT, SEND_DEDUP_S)
+metrics.collector("outbox", lambda: [("gauge", "curvebot_send_queue", {}, outbox.queued())] + [
+    ("counter", f"curvebot_send_{k}_total", {}, v) for k, v in outbox.stats.items()])
+
+async def safe_send(text: str, *, md: bool=True, chat_id=None):
+    await outbox.send(chat_id or CHAT_ID, text, md)
+
+def errors_note(errors: dict):
+    if not errors:
+        return ""
+    return "\n\n_⚠️ частичные данные, не ответили: " + ", ".join(sorted(errors)) + "_"
 
 async def handle_chain(session, chain: str, limit=25, sort_key="volume"):
-    snap = await fetch_chain_snapshot(session, chain)
+    errors = {}
+    snap = await snapshots.get(session, chain, errors)
     if not snap:
         return f"⚠️ Нет данных по сети *{chain}* сейчас. Попробуй позже."
-    return format_chain_table(chain, snap, limit, sort_key)
+    return format_chain_table(chain, snap, limit, sort_key) + errors_note(errors)
 
 async def handle_top_all(session, limit=25, sort_key="volume"):
-    acc = []
-    for ch in CHAINS:
-        rows = await fetch_chain_snapshot(session, ch)
-        for r in rows:
-            r = dict(r)
-            r["name"] = f"[{ch}] {r['name']}"
-            acc.append(r)
-    if not acc:
+    errs = {ch: {} for ch in CHAINS}
+    snaps = await asyncio.gather(*(snapshots.get(session, ch, errs[ch]) for ch in CHAINS))
+    if not any(snaps):
         return "⚠️ No data."
-    return format_chain_table("All Chains", acc, limit, sort_key)
+
+    def render():
+        rows = []
+        for snap, i in merge_top(snaps, sort_key, limit):
+            r = snap.row(i)
+            r["name"] = f"[{snap.chain}] {r['name']}"
+            rows.append(r)
+        return format_table("All Chains", rows, sort_key, min(s.ts for s in snaps))
+
+    errors = {f"{ch}/{name}": e for ch, es in errs.items() for name, e in es.items()}
+    key = ("all", sort_key, limit, tuple(s.version for s in snaps))
+    return cached_render(key, render) + errors_note(errors)
+
+# ---------- commands ----------
+SORT_KEYS = ("volume", "tvl", "apy", "rewards")
+
+LIMIT_MAX = 100   # строк в таблице: больше — это десятки сообщений на одну команду
+
+def _int_arg(parts, i, default=25):
+    return int(parts[i]) if len(parts) > i and parts[i].isdigit() else default
+
+def _limit_arg(parts, i):
+    return min(_int_arg(parts, i), LIMIT_MAX)
+
+async def cmd_ping(session, parts):
+    return "pong"
+
+async def cmd_help(session, parts):
+    return HELP
+
+async def cmd_chains(session, parts):
+    return ", ".join(CHAINS)
+
+async def cmd_cache(session, parts):
+    st = snapshots.stats
+    ages = ", ".join(f"{ch} {snapshots.age(ch):.0f}s" for ch in CHAINS if snapshots.age(ch) is not None)
+    return (
+        f"hit {st['hit']} • stale {st['stale']} • miss {st['miss']} • "
+        f"refresh {st['refresh']} (failed {st['refresh_failed']}) • restored {st['restored']}\n"
+        f"sources: 304 {source_stats['not_modified']} • same {source_stats['same_body']} • "
+        f"parsed {source_stats['parsed']}\n"
+        f"http: retried {source_stats['retried']} • hedged {source_stats['hedged']} • "
+        f"fail-fast {source_stats['fail_fast']} • stale {source_stats['stale']} • "
+        f"breakers open {sum(b.is_open() for b in _breakers.values())}\n"
+        f"render: hit {render_stats['hit']} • miss {render_stats['miss']}\n"
+        f"age: {ages or '-'}"
+    )
+
+async def cmd_alias(session, parts):
+    # быстрые алиасы для дефолтной сети: /vol /apy /tvl /rewards [limit]
+    name = parts[0][1:].lower()
+    sort = next(v for k, v in ALIASES.items() if name.startswith(k))
+    return await handle_chain(session, DEFAULT_CHAIN, limit=_limit_arg(parts, 1), sort_key=sort)
+
+async def cmd_top(session, parts):
+    # /top volume all [limit]
+    if len(parts) >= 3 and parts[2] == "all":
+        sort = parts[1] if parts[1] in SORT_KEYS else "volume"
+        return await handle_top_all(session, limit=_limit_arg(parts, 3), sort_key=sort)
+    return "Usage: /top <volume|tvl|apy|rewards> all [limit]"
+
+async def cmd_chain(session, parts):
+    # /<chain> [limit] [sort]
+    chain = parts[0][1:].lower()
+    sort = parts[2] if len(parts) >= 3 and parts[2] in SORT_KEYS else "volume"
+    return await handle_chain(session, chain, limit=_limit_arg(parts, 1), sort_key=sort)
+
+def _ms(h, q):
+    v = h.quantile(q) if h else None
+    return "-" if v is None else ("inf" if v == math.inf else f"{v * 1000:.0f}ms")
+
+def _ratio(hit, total):
+    return f"{hit / total * 100:.0f}%" if total else "-"
+
+async def cmd_stats(session, parts):
+    st, rs = snapshots.stats, render_stats
+    up = time.time() - metrics.started
+    lines = [f"uptime {up / 3600:.1f}h • loop lag p99 {_ms(metrics.hist('curvebot_loop_lag_seconds'), 0.99)}"]
+    for labels, h in metrics.hists("curvebot_reply_seconds"):
+        lines.append(f"reply ({labels['mode']}): {h.count} • p50 {_ms(h, 0.5)} • p95 {_ms(h, 0.95)}")
+    for labels, h in sorted(metrics.hists("curvebot_command_seconds"), key=lambda x: -x[1].count):
+        lines.append(f"/{labels['command']}: {h.count} • p50 {_ms(h, 0.5)} • p95 {_ms(h, 0.95)}")
+    lookups = st["hit"] + st["stale"] + st["miss"]
+    lines.append(f"snapshot cache hit {_ratio(st['hit'] + st['stale'], lookups)} of {lookups}"
+                 f" • render cache hit {_ratio(rs['hit'], rs['hit'] + rs['miss'])}")
+    # пять самых медленных источников
+    fetch = sorted(metrics.hists("curvebot_fetch_seconds"), key=lambda x: -(x[1].quantile(0.95) or 0))
+    for labels, h in fetch[:5]:
+        src = "/".join(x for x in (labels["endpoint"], labels["chain"], labels["registry"]) if x)
+        lines.append(f"fetch {src}: p95 {_ms(h, 0.95)} ({h.count})")
+    for ch in CHAINS:
+        h = metrics.hist("curvebot_merge_seconds", chain=ch)
+        if h:
+            lines.append(f"merge {ch}: p95 {_ms(h, 0.95)} • {metrics.gauge('curvebot_pools', chain=ch) or 0:.0f} pools")
+    lines.append(f"format p95 {_ms(metrics.hist('curvebot_format_seconds'), 0.95)}"
+                 f" • send p95 {_ms(metrics.hist('curvebot_send_seconds'), 0.95)}"
+                 f" • send queue {outbox.queued()}")
+    if profiler.running():
+        lines.append(f"profiler on: {profiler.samples} samples")
+    return "\n".join(lines)
+
+async def cmd_profile(session, parts):
+    # /profile on [interval_ms] | off | status
+    arg = parts[1].lower() if len(parts) > 1 else "status"
+    if arg == "on":
+        if profiler.running():
+            return "profiler already on"
+        profiler.start(_int_arg(parts, 2, 10) / 1000)
+        return f"profiler on, every {profiler.interval * 1000:.0f}ms — /profile off to dump"
+    if arg == "off":
+        if not profiler.running():
+            return "profiler is off"
+        path = await asyncio.to_thread(profiler.stop_and_dump, PROFILE_DIR)
+        if path is None:   # пока ждали поток, остановил /debug/profile
+            return "profiler is off"
+        hot = "\n".join(f"{n:>6}  {fn}" for fn, n in profiler.top(10))
+        return f"{profiler.samples} samples → {path}\n{hot}"
+    return f"profiler {'on' if profiler.running() else 'off'}, {profiler.samples} samples"
+
+WATCH_USAGE = (
+    "Usage:\n"
+    "/watch — list\n"
+    "/watch tvl <chain> <drop %> <pool> — TVL falls by the given percent\n"
+    "/watch apy <chain> <N> <pool> — base APY rises above N%\n"
+    "/watch new <chain> [min tvl, e.g. 5m] — new pool on the chain\n"
+    "/unwatch <id…|all>\n"
+    "pool — address (0x…, prefix ok) or name"
+)
+
+async def cmd_watch(session, parts, chat_id):
+    if len(parts) == 1:
+        ws = watches.of_chat(chat_id)
+        return "\n".join(w.describe() for w in ws) if ws else "No watches.\n" + WATCH_USAGE
+    kind = parts[1].lower()
+    chain = parts[2].lower() if len(parts) > 2 else ""
+    if kind not in ("tvl", "apy", "new") or chain not in CHAINS:
+        return WATCH_USAGE
+    if len(watches.of_chat(chat_id)) >= WATCH_MAX:
+        return f"Limit is {WATCH_MAX} watches per chat — /unwatch some first."
+    if kind == "new":
+        min_tvl = parse_usd(parts[3]) if len(parts) > 3 else MIN_TVL
+        if min_tvl is None:
+            return WATCH_USAGE
+        return "Watching: " + watches.add(chat_id, "new", chain, max(min_tvl, MIN_TVL)).describe()
+    threshold = parse_usd(parts[3].rstrip("%")) if len(parts) > 4 else None
+    if threshold is None or (kind == "tvl" and not 0 < threshold < 100):
+        return WATCH_USAGE
+    snap = await snapshots.get(session, chain)
+    i = snap.find(" ".join(parts[4:]))
+    if i is None:
+        return f"Pool not found or ambiguous on {chain}: {' '.join(parts[4:])}"
+    if kind == "tvl":
+        w = watches.add(chat_id, "tvl", chain, threshold, snap.address[i], snap.name[i], snap.tvl[i])
+        return "Watching: " + w.describe()
+    w = watches.add(chat_id, "apy", chain, threshold, snap.address[i], snap.name[i])
+    now = f"\nnow {pct(snap.base_apy[i])}" + (" — already above" if snap.base_apy[i] > threshold else "")
+    return "Watching: " + w.describe() + now
+
+async def cmd_unwatch(session, parts, chat_id):
+    if len(parts) < 2:
+        return "Usage: /unwatch <id…|all>"
+    if parts[1].lower() == "all":
+        gone = watches.remove(chat_id)
+    else:
+        gone = watches.remove(chat_id, {int(p.lstrip("#")) for p in parts[1:] if p.lstrip("#").isdigit()})
+    return f"Removed {len(gone)}." if gone else "Nothing to remove."
+
+SERIES_SORTS = dict(SORT_COLUMNS)   # volume | tvl | apy | rewards -> колонка
+
+def _fmt_metric(metric: str, v: float):
+    return usd_short(v) if metric in ("tvl", "volume") else pct(v)
+
+async def cmd_movers(session, parts):
+    # /movers <chain> [window] [sort] — из истории в памяти, без запросов к API
+    chain = parts[1].lower() if len(parts) > 1 else DEFAULT_CHAIN
+    if chain not in CHAINS:
+        return "Usage: /movers <chain> [window: 30m|1h|6h|1d] [volume|tvl|apy|rewards]"
+    window, sort = 3600.0, "volume"
+    for p in parts[2:]:
+        if parse_window(p):
+            window = parse_window(p)
+        elif p.lower() in SERIES_SORTS:
+            sort = p.lower()
+    cs = series.get(chain)
+    metric = SERIES_SORTS[sort]
+    moves = cs.movers(metric, window, 15) if cs else []
+    if not moves:
+        return f"No history for {chain} over {window / 3600:g}h yet (it builds up on every refresh)."
+    unit = "%" if metric in ("tvl", "volume") else " pp"
+    lines = [f"{chain}: {sort} movers, {window / 3600:g}h"]
+    for s, was, now, d in moves:
+        lines.append(f"{d:+.1f}{unit}  {cs.name[s]}  {_fmt_metric(metric, was)} → {_fmt_metric(metric, now)}")
+    return "\n".join(lines)
+
+async def cmd_trend(session, parts):
+    # /trend <chain> <pool> [window]
+    if len(parts) < 3 or parts[1].lower() not in CHAINS:
+        return "Usage: /trend <chain> <pool address or name> [window: 1h|6h|1d|7d]"
+    chain = parts[1].lower()
+    window = parse_window(parts[-1]) if len(parts) > 3 else None
+    query = " ".join(parts[2:-1] if window else parts[2:])
+    window = window or 6 * 3600
+    cs = series.get(chain)
+    if cs is None:
+        return f"No history for {chain} yet."
+    snap = await snapshots.get(session, chain)
+    i = snap.find(query)
+    s = cs.slot.get(snap.address[i]) if i is not None else None
+    if s is None:
+        return f"Pool not found or has no history on {chain}: {query}"
+    lines = [f"{cs.name[s]} ({chain}), {window / 3600:g}h"]
+    for sort, metric in SERIES_SORTS.items():
+        points = cs.trend(s, metric, window)
+        vals = [p for p in points if p is not None]
+        if not vals:
+            continue
+        lines.append(f"{sort:8} {sparkline(resample(points, 32))}  "
+                     f"{_fmt_metric(metric, vals[0])} → {_fmt_metric(metric, vals[-1])}")
+    return "\n".join(lines)
+
+# имя команды -> (обработчик, Markdown?)
+COMMANDS = {
+    "ping":   (cmd_ping, True),
+    "help":   (cmd_help, True),
+    "chains": (cmd_chains, False),
+    "cache":  (cmd_cache, False),
+    "top":    (cmd_top, True),
+    "movers": (cmd_movers, False),
+    "trend":  (cmd_trend, False),
+}
+ADMIN_COMMANDS = {
+    "stats":   (cmd_stats, False),
+    "profile": (cmd_profile, False),
+}
+# обработчик получает chat_id; такие команды объединяются только внутри чата
+CHAT_COMMANDS = {
+    "watch":   (cmd_watch, False),
+    "unwatch": (cmd_unwatch, False),
+}
+ALIASES = {"vol": "volume", "apy": "apy", "tvl": "tvl", "rewards": "rewards"}   # префикс -> sort
+
+def is_admin(chat_id, user_id):
+    if ADMIN_IDS:
+        return user_id in ADMIN_IDS
+    return chat_id is not None and str(chat_id) == str(CHAT_ID)
+
+def route(text: str, chat_id=None, user_id=None):
+    """
+    (обработчик, md, parts) для текста команды или None.
+    Порядок: точные команды, админские (только is_admin), алиасы по
+    префиксу (/vol, /volume…), затем /<chain>.
+    """
+    parts = text.split()
+    if not parts or not parts[0].startswith("/"):
+        return None
+    parts[0] = parts[0].split("@", 1)[0]   # /ping@curve_bot
+    name = parts[0][1:].lower()
+    if name in COMMANDS:
+        handler, md = COMMANDS[name]
+        return handler, md, parts
+    if name in ADMIN_COMMANDS:
+        if not is_admin(chat_id, user_id):
+            return None
+        handler, md = ADMIN_COMMANDS[name]
+        return handler, md, parts
+    if name in CHAT_COMMANDS:
+        handler, md = CHAT_COMMANDS[name]
+        return functools.partial(handler, chat_id=chat_id), md, parts
+    if any(name.startswith(k) for k in ALIASES):
+        return cmd_alias, True, parts
+    if name in CHAINS:
+        return cmd_chain, True, parts
+    return None
+
+# ---------- dispatch ----------
+class Dispatcher:
+    """
+    Каждая команда — отдельная задача, одновременно выполняется не больше
+    workers обработчиков. Ответы в чат уходят в порядке команд (своя
+    очередь на чат), а одинаковые команды, пришедшие пока первая ещё
+    считается, делят один результат.
+    """
+    def __init__(self, session, workers: int, mode: str = "poll"):
+        self.session = session
+        self.mode = mode      # poll | webhook — метка для задержки «пришло → ответили»
+        self.stats = {"commands": 0, "coalesced": 0, "errors": 0}
+        self._sem = asyncio.Semaphore(workers)
+        self._inflight = {}   # нормализованный текст команды -> Task
+        self._chats = {}      # chat_id -> deque задач в порядке прихода
+        self._senders = {}    # chat_id -> Task отправки
+        metrics.collector("dispatch", lambda: [("counter", f"curvebot_dispatch_{k}_total", {}, v) for k, v in self.stats.items()] + [
+            ("gauge", "curvebot_dispatch_inflight", {}, len(self._inflight))])
+
+    def submit(self, chat_id, text: str, user_id=None, received: float = None):
+        r = route(text, chat_id, user_id)
+        if r is None:
+            return None
+        handler, md, parts = r
+        self.stats["commands"] += 1
+        key = " ".join(parts).lower()
+        if isinstance(handler, functools.partial):   # команда чата (CHAT_COMMANDS)
+            key = (chat_id, key)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._run(handler, parts))
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            self.stats["coalesced"] += 1
+        self._chats.setdefault(chat_id, collections.deque()).append((task, md, received or time.perf_counter()))
+        if chat_id not in self._senders:
+            self._senders[chat_id] = asyncio.ensure_future(self._drain(chat_id))
+        return task
+
+    async def _run(self, handler, parts):
+        async with self._sem:
+            t = time.perf_counter()
+            try:
+                return await handler(self.session, parts)
+            finally:
+                metrics.observe("curvebot_command_seconds", time.perf_counter() - t,
+                                command=getattr(handler, "func", handler).__name__[4:])
+
+    async def _drain(self, chat_id):
+        q = self._chats[chat_id]
+        try:
+            while q:
+                task, md, received = q[0]
+                try:
+                    out = await asyncio.shield(task)
+                    await safe_send(out, md=md, chat_id=chat_id)
+                    metrics.observe("curvebot_reply_seconds", time.perf_counter() - received, mode=self.mode)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print("command error:", e)
+                q.popleft()
+        finally:
+            self._senders.pop(chat_id, None)
+            if not q:
+                self._chats.pop(chat_id, None)
+
+# ---------- profiling ----------
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: отдельный поток раз в interval снимает стек
+    потока event loop'а (sys._current_frames) и копит «свёрнутые» стеки —
+    формат flamegraph.pl / speedscope. Включается и выключается на ходу.
+    start() возвращает номер запуска: остановить можно только свой запуск
+    (/profile off и /debug/profile не мешают друг другу).
+    """
+    def __init__(self):
+        self.interval = 0.01
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+        self._run_id = None
+        self._run_ids = itertools.count(1)
+        self._lock = threading.Lock()   # stop_and_dump идёт из потока to_thread
+
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval: float = 0.01):
+        with self._lock:
+            self.interval = max(interval, 0.001)
+            self.samples = 0
+            self.stacks = collections.Counter()
+            self._target = threading.get_ident()
+            self._stop = threading.Event()   # своё на запуск — остановка старого не заденет новый
+            self._run_id = next(self._run_ids)
+            self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return self._run_id
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop_and_dump(self, directory: str, run: int = None):
+        # путь к файлу; None — уже остановлен (или идёт не запуск run)
+        with self._lock:
+            if self._thread is None or (run is not None and run != self._run_id):
+                return None
+            thread, stop, stacks = self._thread, self._stop, self.stacks
+            self._thread = None
+        stop.set()
+        thread.join()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, datetime.now().strftime("profile-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w") as fh:
+            for stack, n in stacks.most_common():
+                fh.write(f"{stack} {n}\n")
+        return path
+
+    def top(self, n: int):
+        # self-time: по верхнему кадру стека, без номера строки
+        leaf = collections.Counter()
+        for stack, c in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1].rsplit(":", 1)[0] + ")"] += c
+        return leaf.most_common(n)
+
+profiler = SamplingProfiler()
+
+async def loop_lag_monitor(interval: float = 0.5):
+    # насколько позже обещанного просыпается sleep — задержка event loop'а
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - t - interval, 0.0)
+        metrics.observe("curvebot_loop_lag_seconds", lag)
+        metrics.set("curvebot_loop_lag_last_seconds", lag)
+
+async def start_metrics_server():
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def handle_profile(request):
+        # GET /debug/profile?seconds=10 — снять профиль и отдать свёрнутые стеки
+        if profiler.running():
+            return web.Response(status=409, text="profiler already running\n")
+        try:
+            seconds = min(float(request.query.get("seconds", "10")), 300)
+            interval = min(float(request.query.get("interval_ms", "10")) / 1000, 1)
+        except ValueError:
+            seconds = interval = 0
+        if not (seconds > 0 and interval > 0):   # заодно отсекает nan
+            return web.Response(status=400, text="seconds and interval_ms must be positive numbers\n")
+        run = profiler.start(interval)
+        await asyncio.sleep(seconds)
+        stacks = profiler.stacks
+        if await asyncio.to_thread(profiler.stop_and_dump, PROFILE_DIR, run) is None:
+            return web.Response(status=409, text="profiler was stopped by /profile off\n")
+        body = "".join(f"{st} {n}\n" for st, n in stacks.most_common())
+        return web.Response(text=body, content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/debug/profile", handle_profile)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    print(f"📈 metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+# ---------- ingestion ----------
+def update_text(upd):
+    """
+    (chat_id, user_id, text) из Update, пришедшего webhook'ом; text None — апдейт
+    без текста (фото, правка и т.п.). ValueError — тело не похоже на Update.
+    """
+    if not isinstance(upd, dict) or not isinstance(upd.get("update_id"), int):
+        raise ValueError("update is not an object with update_id")
+    m = upd.get("message")
+    if m is None:
+        return None, None, None
+    if not isinstance(m, dict):
+        raise ValueError("message is not an object")
+    text, chat, user = m.get("text"), m.get("chat") or {}, m.get("from") or {}
+    if text is None:
+        return None, None, None
+    if not (isinstance(text, str) and isinstance(chat, dict) and isinstance(user, dict)):
+        raise ValueError("malformed message")
+    return chat.get("id"), user.get("id"), text
+
+def ingest(dispatcher, chat_id, user_id, text: str):
+    text = text.strip()
+    print(">", text)
+    dispatcher.submit(chat_id, text, user_id, time.perf_counter())
+
+async def poll_updates(dispatcher):
+    # long-poll не ждёт обработчиков: команды уходят в dispatcher и
+    # сразу идёт следующий getUpdates
+    try:
+        await bot.delete_webhook()   # иначе getUpdates отвечает 409, если остался webhook
+    except Exception:
+        pass
+    offset = 0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_INTERVAL)
+            for u in updates or []:
+                offset = u.update_id + 1
+                m = getattr(u, "message", None)
+                if not m or not m.text:
+                    continue
+                ingest(dispatcher, m.chat_id, getattr(m.from_user, "id", None), m.text)
+        except Exception as e:
+            print("loop error:", e)
+            await asyncio.sleep(1.5)
+
+async def start_webhook(dispatcher):
+    """
+    Встроенный сервер для webhook'а: Telegram сам POST'ит апдейты, без
+    круга getUpdates. Ответ 200 — сразу, команда уходит в тот же dispatcher.
+    Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются.
+    """
+    seen, seen_order = set(), collections.deque()   # update_id недавних апдейтов — повторы Telegram
+
+    async def handle_update(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            metrics.inc("curvebot_webhook_total", result="forbidden")
+            return web.Response(status=403)
+        try:
+            upd = orjson.loads(await request.read())
+            chat_id, user_id, text = update_text(upd)
+        except ValueError:   # не JSON (orjson.JSONDecodeError) или не Update
+            metrics.inc("curvebot_webhook_total", result="bad_request")
+            return web.Response(status=400)
+        uid = upd.get("update_id")
+        if uid in seen:
+            metrics.inc("curvebot_webhook_total", result="duplicate")
+            return web.Response()
+        seen.add(uid)
+        seen_order.append(uid)
+        if len(seen_order) > 1024:
+            seen.discard(seen_order.popleft())
+        metrics.inc("curvebot_webhook_total", result="ok")
+        if text:
+            ingest(dispatcher, chat_id, user_id, text)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=["message"])
+    except Exception:
+        await runner.cleanup()
+        raise
+    print(f"🪝 webhook {WEBHOOK_URL} → {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return runner
 
 # ---------- main loop ----------
 async def updates_loop():
@@ -283,63 +2612,62 @@ async def updates_loop():
     )
     print(default_hint)
 
-    offset = 0
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
+    async with http_session() as session:
         try:
             await safe_send("✅ bot online")
         except Exception:
             pass
+        await watches.load()
+        await series.load()
+        warm_task = asyncio.create_task(warm_loop(session))
+        lag_task = asyncio.create_task(loop_lag_monitor())
+        runners = [await start_metrics_server()] if METRICS_PORT else []
+        try:
+            if WEBHOOK_URL:
+                dispatcher = Dispatcher(session, DISPATCH_WORKERS, "webhook")
+                try:
+                    runners.append(await start_webhook(dispatcher))
+                    await asyncio.Event().wait()   # дальше апдейты приходят в handle_update
+                except (OSError, TelegramError) as e:
+                    print("webhook unavailable, falling back to getUpdates:", e)
+            await poll_updates(Dispatcher(session, DISPATCH_WORKERS, "poll"))
+        finally:
+            lag_task.cancel()
+            warm_task.cancel()
+            for runner in runners:
+                await runner.cleanup()
 
-        while True:
-            try:
-                updates = await bot.get_updates(offset=offset, timeout=POLL_INTERVAL)
-                for u in updates or []:
-                    offset = u.update_id + 1
-                    m = getattr(u, "message", None)
-                    if not m or not m.text:
-                        continue
-                    text = m.text.strip()
-                    print(">", text)
-
-                    if text == "/ping":
-                        await safe_send("pong"); continue
-                    if text == "/help":
-                        await safe_send(HELP); continue
-                    if text == "/chains":
-                        await safe_send(", ".join(CHAINS), md=False); continue
-
-                    # быстрые алиасы для дефолтной сети
-                    if text.startswith("/vol") or text.startswith("/apy") or text.startswith("/tvl") or text.startswith("/rewards"):
-                        parts = text.split()
-                        limit = int(parts[1]) if len(parts) >= 2 and parts[1].isdigit() else 25
-                        sort  = "volume" if text.startswith("/vol") else \
-                                "apy" if text.startswith("/apy") else \
-                                "tvl" if text.startswith("/tvl") else "rewards"
-                        out = await handle_chain(session, DEFAULT_CHAIN, limit=limit, sort_key=sort)
-                        await safe_send(out); continue
-
-                    # /top volume all [limit]
-                    if text.startswith("/top"):
-                        parts = text.split()
-                        if len(parts) >= 3 and parts[2] == "all":
-                            sort  = parts[1] if parts[1] in ("volume","tvl","apy","rewards") else "volume"
-                            limit = int(parts[3]) if len(parts) >= 4 and parts[3].isdigit() else 25
-                            out = await handle_top_all(session, limit=limit, sort_key=sort)
-                            await safe_send(out); continue
-                        await safe_send("Usage: /top <volume|tvl|apy|rewards> all [limit]"); continue
-
-                    # /<chain> [limit] [sort]
-                    if text.startswith("/"):
-                        parts = text.split()
-                        chain = parts[0][1:].lower()
-                        if chain in CHAINS:
-                            limit = int(parts[1]) if len(parts) >= 2 and parts[1].isdigit() else 25
-                            sort  = parts[2] if len(parts) >= 3 and parts[2] in ("volume","tvl","apy","rewards") else "volume"
-                            out = await handle_chain(session, chain, limit=limit, sort_key=sort)
-                            await safe_send(out); continue
-            except Exception as e:
-                print("loop error:", e)
-            await asyncio.sleep(1.5)
+async def collector_loop():
+    """
+    ROLE=collector: весь опрос Curve API по всем CHAINS в одном процессе,
+    каждый новый снапшот публикуется в SHM_DIR для ответчиков.
+    """
+    publisher = SnapshotPublisher(SHM_DIR)
+    snapshots.listeners[:] = [publisher.on_snapshot]   # подписки и история — на стороне ответчиков
+    metrics.collector("publisher", lambda: [("counter", f"curvebot_publish_{k}_total", {}, v)
+                                            for k, v in publisher.stats.items()])
+    print(f"📦 collector: {', '.join(CHAINS)} → {SHM_DIR}")
+    async with http_session() as session:
+        runner = await start_metrics_server() if METRICS_PORT else None
+        try:
+            # то, что есть сразу (в т.ч. с диска), — публикуем, не дожидаясь свежего
+            for ch in CHAINS:
+                snap = await snapshots.get(session, ch)
+                if snap:
+                    publisher.publish(snap, snapshots.errors(ch))
+            period = max(SNAPSHOT_TTL * 0.8, 1)
+            while True:
+                await asyncio.gather(*(snapshots.refresh(session, ch) for ch in CHAINS), return_exceptions=True)
+                for ch in CHAINS:
+                    # новые снапшоты уже опубликованы слушателем; неизменившиеся —
+                    # только отметка, что данные проверены сейчас
+                    age = snapshots.age(ch)
+                    if age is not None and age < period:
+                        publisher.verify(ch, time.time() - age, snapshots.errors(ch))
+                await asyncio.sleep(period)
+        finally:
+            if runner:
+                await runner.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(updates_loop())
\ No newline at end of file
+    asyncio.run(collector_loop() if ROLE == "collector" else updates_loop())
@@ -8,7 +8,7 @@ import aiohttp
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 assert TOKEN, "Нет TELEGRAM_TOKEN в .env"
 
-TG_BASE = f"https://api.telegram.org/bot{TOKEN}"
+TG_BASE = f"{os.getenv('TELEGRAM_API_BASE') or 'https://api.telegram.org/bot'}{TOKEN}"
 
 async def main():
     offset = None
@@ -0,0 +1,241 @@
+# fake_curve.py — локальная замена curve-api v1 для бенчмарков
+#
+#   python fake_curve.py serve --port 8780 --pools 4000 --latency-ms 80 --jitter-ms 40
+#   python fake_curve.py serve --data recorded/ --pools 6000 --error-rate 0.02
+#   python fake_curve.py record recorded/ ethereum arbitrum polygon
+#
+# serve  — отдаёт /v1/getPools/{chain}/{registry}, /v1/getVolumes/{chain},
+#          /v1/getBaseApys/{chain}. Данные — записанные ответы из --data
+#          (размноженные до --pools пулов на сеть) или сгенерированные.
+#          Задержка, ошибки (5xx) и ETag/304 настраиваются.
+# record — скачивает живые ответы api.curve.finance в каталог для serve --data.
+#
+# Для бота: CURVE_API_BASE=http://127.0.0.1:8780/v1
+
+import os, json, random, asyncio, hashlib, argparse
+from aiohttp import web, ClientSession, ClientTimeout
+
+LIVE_API = "https://api.curve.finance/v1"
+REGISTRIES = [
+    "main", "factory", "crypto", "factory-crypto", "factory-crvusd",
+    "factory-twocrypto", "factory-tricrypto", "factory-eywa", "factory-stable-ng"
+]
+SOURCES = ["getVolumes", "getBaseApys"] + [f"getPools/{reg}" for reg in REGISTRIES]
+
+# ---------- payloads ----------
+def _addr(rnd):
+    return "0x" + "".join(rnd.choice("0123456789abcdefABCDEF") for _ in range(40))
+
+def _coin(rnd):
+    return {
+        "address": _addr(rnd), "usdPrice": rnd.uniform(0.5, 3500), "decimals": "18",
+        "isBasePool": False, "symbol": rnd.choice(["USDC", "USDT", "DAI", "WETH", "crvUSD", "WBTC"]),
+        "name": "Token", "poolBalance": str(rnd.randrange(10**18, 10**27)),
+    }
+
+def _volumes(pools, rnd):
+    return json.dumps({"success": True, "data": {"pools": [
+        {"address": p["address"], "type": "main", "volumeUSD": rnd.lognormvariate(11, 3),
+         "latestDailyApyPcent": rnd.uniform(0, 8), "latestWeeklyApyPcent": rnd.uniform(0, 8),
+         "virtualPrice": 1.0}
+        for p in pools]}}).encode()
+
+def make_payloads(chain: str, n_pools: int, seed: int = 1):
+    """{источник: bytes} для одной сети — в форме ответов curve-api v1."""
+    rnd = random.Random(seed)
+    pools = []
+    for i in range(n_pools):
+        addr = _addr(rnd)
+        tvl = rnd.lognormvariate(13, 3)   # медиана ~0.4M, хвост до миллиардов
+        pools.append({
+            "id": f"factory-v2-{i}", "address": addr, "name": f"Curve.fi Factory Pool {i}",
+            "symbol": f"POOL{i}-f", "assetTypeName": "usd", "implementation": "plain",
+            "coinsAddresses": [_addr(rnd), _addr(rnd)], "decimals": ["18", "6"],
+            "virtualPrice": str(10**18 + rnd.randrange(10**16)), "amplificationCoefficient": "200",
+            "totalSupply": str(rnd.randrange(10**20, 10**26)), "lpTokenAddress": addr,
+            "poolUrls": {
+                "swap": [f"https://curve.fi/dex/#/{chain}/pools/factory-v2-{i}/swap"],
+                "deposit": [f"https://curve.fi/dex/#/{chain}/pools/factory-v2-{i}/deposit"],
+                "withdraw": [f"https://curve.fi/dex/#/{chain}/pools/factory-v2-{i}/withdraw"],
+            },
+            "coins": [_coin(rnd), _coin(rnd)],
+            "usdTotal": tvl, "usdTotalExcludingBasePool": tvl, "isMetaPool": False,
+            "gaugeAddress": _addr(rnd), "gaugeRewards": [],
+            "gaugeCrvApy": [rnd.uniform(0, 5), rnd.uniform(5, 12)] if rnd.random() < 0.4 else [None, None],
+            "isBroken": False, "creationTs": 1690000000 + i, "blockchainId": chain,
+        })
+    bodies = {}
+    for k, reg in enumerate(REGISTRIES):
+        part = pools[k::len(REGISTRIES)]
+        bodies[f"getPools/{reg}"] = json.dumps({"success": True, "data": {"poolData": part}}).encode()
+    bodies["getVolumes"] = _volumes(pools, rnd)
+    bodies["getBaseApys"] = json.dumps({"success": True, "data": {"baseApys": [
+        {"address": p["address"], "latestDailyApyPcent": rnd.uniform(0, 8),
+         "latestWeeklyApyPcent": rnd.uniform(0, 8) if rnd.random() < 0.9 else None}
+        for p in pools]}}).encode()
+    return bodies
+
+def _clone_addr(addr: str, k: int):
+    return "0x" + hashlib.blake2b(f"{addr}:{k}".encode(), digest_size=20).hexdigest()
+
+def scale_payloads(bodies: dict, n_pools: int):
+    """
+    Размножает записанные ответы до n_pools пулов: копии получают новые
+    адреса (детерминированно), а объёмы и APY — копии записей исходного пула.
+    """
+    data = {name: json.loads(b) for name, b in bodies.items()}
+    have = sum(len(data[f"getPools/{reg}"]["data"].get("poolData") or []) for reg in REGISTRIES
+               if f"getPools/{reg}" in data)
+    if have == 0 or have >= n_pools:
+        return bodies
+    copies = -(-n_pools // have) - 1
+    clones = {}   # исходный адрес (lower) -> [адреса копий]
+    for reg in REGISTRIES:
+        d = data.get(f"getPools/{reg}")
+        if not d:
+            continue
+        pools = d["data"].get("poolData") or []
+        extra = []
+        for p in pools:
+            for k in range(1, copies + 1):
+                q = dict(p, address=_clone_addr(p["address"], k))
+                q["name"] = f"{p.get('name') or ''} #{k}"
+                q.pop("poolUrls", None)
+                extra.append(q)
+                clones.setdefault(p["address"].lower(), []).append(q["address"])
+        d["data"]["poolData"] = pools + extra
+    for name, key in (("getVolumes", "pools"), ("getBaseApys", "baseApys")):
+        d = data.get(name)
+        if not d:
+            continue
+        rows = d["data"].get(key) or []
+        d["data"][key] = rows + [dict(r, address=a) for r in rows
+                                 for a in clones.get((r.get("address") or "").lower(), ())]
+    return {name: json.dumps(d).encode() for name, d in data.items()}
+
+def load_recorded(path: str, chain: str):
+    out = {}
+    for name in SOURCES:
+        f = os.path.join(path, chain, name.replace("/", "-") + ".json")
+        if os.path.exists(f):
+            with open(f, "rb") as fh:
+                out[name] = fh.read()
+    return out
+
+# ---------- server ----------
+class FakeCurve:
+    """
+    Отдаёт payload'ы сетей с задержкой latency ± jitter (сек), с вероятностью
+    error_rate отвечает 503. ETag = хэш тела, на If-None-Match — 304.
+    getVolumes чередует variants вариантов чисел — как живой API между опросами.
+    """
+    def __init__(self, payloads: dict, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, variants: dict = None, seed: int = 1):
+        self.payloads = payloads          # chain -> {источник: bytes}
+        self.variants = variants or {}    # chain -> [bytes] для getVolumes
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.rnd = random.Random(seed)
+        self.stats = {"requests": 0, "not_modified": 0, "errors": 0, "bytes": 0}
+        self._turn = {}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/v1/getPools/{chain}/{reg}", self._handle)
+        app.router.add_get("/v1/getVolumes/{chain}", self._handle)
+        app.router.add_get("/v1/getBaseApys/{chain}", self._handle)
+        app.router.add_get("/_stats", lambda r: web.json_response(self.stats))
+        return app
+
+    def _body(self, chain: str, name: str):
+        if name == "getVolumes" and self.variants.get(chain):
+            vs = self.variants[chain]
+            k = self._turn[chain] = (self._turn.get(chain, -1) + 1) % len(vs)
+            return vs[k]
+        return self.payloads.get(chain, {}).get(name)
+
+    async def _handle(self, request):
+        self.stats["requests"] += 1
+        chain = request.match_info["chain"]
+        method = request.path.split("/")[2]
+        name = f"{method}/{request.match_info['reg']}" if method == "getPools" else method
+        delay = max(0.0, self.latency + self.rnd.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise web.HTTPServiceUnavailable()
+        body = self._body(chain, name)
+        if body is None:
+            raise web.HTTPNotFound()
+        etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        self.stats["bytes"] += len(body)
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+def build(chains, pools: int, data: str = None, variants: int = 4):
+    payloads, vols = {}, {}
+    for k, ch in enumerate(chains):
+        rec = load_recorded(data, ch) if data else {}
+        if rec:
+            payloads[ch] = scale_payloads(rec, pools)
+        else:
+            payloads[ch] = make_payloads(ch, pools, seed=k + 1)
+        # варианты getVolumes: те же адреса, другие числа
+        rows = json.loads(payloads[ch]["getVolumes"])["data"]["pools"]
+        rnd = random.Random(k)
+        vols[ch] = [payloads[ch]["getVolumes"]] + [
+            json.dumps({"success": True, "data": {"pools": [
+                dict(r, volumeUSD=float(r.get("volumeUSD") or 0) * rnd.uniform(0.8, 1.2)) for r in rows]}}).encode()
+            for _ in range(variants - 1)]
+    return payloads, vols
+
+# ---------- record ----------
+async def record(path: str, chains):
+    async with ClientSession(timeout=ClientTimeout(total=60)) as s:
+        for ch in chains:
+            os.makedirs(os.path.join(path, ch), exist_ok=True)
+            for name in SOURCES:
+                method, _, reg = name.partition("/")
+                url = f"{LIVE_API}/{method}/{ch}" + (f"/{reg}" if reg else "")
+                try:
+                    async with s.get(url) as r:
+                        r.raise_for_status()
+                        body = await r.read()
+                except Exception as e:
+                    print("skip", ch, name, e)
+                    continue
+                with open(os.path.join(path, ch, name.replace("/", "-") + ".json"), "wb") as fh:
+                    fh.write(body)
+                print("saved", ch, name, len(body))
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sv = sub.add_parser("serve")
+    sv.add_argument("--host", default="127.0.0.1")
+    sv.add_argument("--port", type=int, default=8780)
+    sv.add_argument("--chains", default="ethereum,arbitrum,polygon")
+    sv.add_argument("--pools", type=int, default=4000, help="пулов на сеть")
+    sv.add_argument("--data", help="каталог с записанными ответами (fake_curve.py record)")
+    sv.add_argument("--latency-ms", type=float, default=0)
+    sv.add_argument("--jitter-ms", type=float, default=0)
+    sv.add_argument("--error-rate", type=float, default=0)
+    sv.add_argument("--variants", type=int, default=4, help="вариантов getVolumes по кругу")
+    rc = sub.add_parser("record")
+    rc.add_argument("path")
+    rc.add_argument("chains", nargs="+")
+    args = ap.parse_args()
+
+    if args.cmd == "record":
+        asyncio.run(record(args.path, args.chains))
+        return
+    chains = [c.strip() for c in args.chains.split(",") if c.strip()]
+    payloads, vols = build(chains, args.pools, args.data, max(args.variants, 1))
+    fake = FakeCurve(payloads, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, vols)
+    print(f"fake curve-api on http://{args.host}:{args.port}/v1 ({', '.join(chains)}, {args.pools} pools)", flush=True)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
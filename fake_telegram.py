@@ -0,0 +1,201 @@
+# fake_telegram.py — локальная замена Telegram Bot API для бенчмарков
+#
+#   python fake_telegram.py --port 8781 --send-ms 30
+#   curl -XPOST localhost:8781/_inject -d '{"chat_id": 1, "text": "/ping"}'
+#   curl localhost:8781/_stats
+#
+# Понимает getMe, getUpdates (long-poll), sendMessage, setWebhook/deleteWebhook
+# по адресу /bot<token>/<method> — как api.telegram.org. Для бота:
+# TELEGRAM_API_BASE=http://127.0.0.1:8781/bot
+#
+# /_inject кладёт сообщение в очередь апдейтов и запоминает время; /_stats
+# отдаёт по каждому чату время прихода команд и отправки ответов — из них
+# считается задержка (удобнее всего одна команда на чат).
+#
+# После setWebhook апдейты не копятся для getUpdates (он отвечает 409, как
+# настоящий API), а POST'ятся на url с X-Telegram-Bot-Api-Secret-Token.
+
+import time, json, asyncio, argparse, collections
+from aiohttp import web, ClientSession, ClientError
+
+class FakeTelegram:
+    """
+    send_delay — сколько «идёт» sendMessage; flood_every — каждый N-й
+    sendMessage отвечает 429 с retry_after (0 — никогда).
+    """
+    def __init__(self, send_delay: float = 0.0, flood_every: int = 0, retry_after: int = 1):
+        self.send_delay = send_delay
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.stats = {"updates": 0, "sent": 0, "flood": 0, "polls": 0, "pushed": 0, "push_failed": 0}
+        self._updates = []
+        self._next_id = 1
+        self._message_id = 1
+        self._arrived = None
+        self._injected = collections.defaultdict(list)   # chat_id -> [время команды]
+        self._sent = collections.defaultdict(list)       # chat_id -> [время ответа]
+        self.webhook = None        # (url, secret) после setWebhook
+        self._session = None
+        self._pushes = set()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._api)
+        app.router.add_post("/_inject", self._inject)
+        app.router.add_get("/_stats", self._stats)
+        app.router.add_post("/_reset", self._reset)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+    def _event(self):
+        if self._arrived is None:
+            self._arrived = asyncio.Event()
+        return self._arrived
+
+    def inject(self, chat_id: int, text: str):
+        upd = {
+            "update_id": self._next_id,
+            "message": {
+                "message_id": self._message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "group", "title": "bench"},
+                "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+            },
+        }
+        self._next_id += 1
+        self._message_id += 1
+        self._updates.append(upd)
+        self._injected[chat_id].append(time.monotonic())
+        self.stats["updates"] += 1
+        if self.webhook:
+            self._spawn_push(upd)
+        else:
+            self._event().set()
+        return upd
+
+    def _spawn_push(self, upd):
+        t = asyncio.ensure_future(self._push(upd))
+        self._pushes.add(t)
+        t.add_done_callback(self._pushes.discard)
+
+    async def _push(self, upd):
+        # как Telegram: POST апдейта на webhook, при ошибке — ещё пара попыток
+        url, secret = self.webhook
+        if self._session is None:
+            self._session = ClientSession()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        for attempt in range(3):
+            try:
+                async with self._session.post(url, json=upd, headers=headers) as r:
+                    if r.status == 200:
+                        if upd in self._updates:
+                            self._updates.remove(upd)
+                        self.stats["pushed"] += 1
+                        return
+            except ClientError:
+                pass
+            await asyncio.sleep(0.5 * (attempt + 1))
+        self.stats["push_failed"] += 1
+
+    def _message(self, chat_id, text):
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "group", "title": "bench"}}
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(request.query)
+        params.update(await request.post())
+        return params
+
+    async def _api(self, request):
+        method = request.match_info["method"]
+        p = await self._params(request)
+        if method == "getMe":
+            return _ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method == "setWebhook":
+            self.webhook = (p["url"], p.get("secret_token")) if p.get("url") else None
+            if self.webhook:
+                for upd in list(self._updates):   # накопленное до setWebhook — тоже на webhook
+                    self._spawn_push(upd)
+            return _ok(True)
+        if method == "deleteWebhook":
+            self.webhook = None
+            return _ok(True)
+        if method == "getWebhookInfo":
+            return _ok({"url": self.webhook[0] if self.webhook else "", "has_custom_certificate": False,
+                        "pending_update_count": len(self._updates)})
+        if method == "getUpdates":
+            if self.webhook:
+                return web.json_response({"ok": False, "error_code": 409, "description":
+                                          "Conflict: can't use getUpdates method while webhook is active"},
+                                         status=409)
+            return _ok(await self._get_updates(int(p.get("offset") or 0), float(p.get("timeout") or 0)))
+        if method == "sendMessage":
+            return await self._send(int(p["chat_id"]), str(p.get("text") or ""))
+        return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+    async def _get_updates(self, offset: int, timeout: float):
+        self.stats["polls"] += 1
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            ev = self._event()
+            ev.clear()
+            try:
+                await asyncio.wait_for(ev.wait(), min(timeout, 30))
+            except asyncio.TimeoutError:
+                pass
+        return [u for u in self._updates if u["update_id"] >= offset]
+
+    async def _send(self, chat_id: int, text: str):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        n = self.stats["sent"] + self.stats["flood"] + 1
+        if self.flood_every and n % self.flood_every == 0:
+            self.stats["flood"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}}, status=429)
+        self.stats["sent"] += 1
+        self._sent[chat_id].append(time.monotonic())
+        return _ok(self._message(chat_id, text))
+
+    async def _inject(self, request):
+        body = await request.json()
+        items = body if isinstance(body, list) else [body]
+        ids = [self.inject(int(it["chat_id"]), it["text"])["update_id"] for it in items]
+        return web.json_response({"ok": True, "update_ids": ids})
+
+    async def _stats(self, request):
+        chats = {str(c): {"in": t, "out": self._sent.get(c, [])} for c, t in self._injected.items()}
+        return web.json_response({**self.stats, "chats": chats})
+
+    async def _reset(self, request):
+        self._updates.clear()
+        self.webhook = None
+        self._injected.clear()
+        self._sent.clear()
+        self.stats = dict.fromkeys(self.stats, 0)
+        return web.json_response({"ok": True})
+
+def _ok(result):
+    return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8781)
+    ap.add_argument("--send-ms", type=float, default=0, help="задержка sendMessage")
+    ap.add_argument("--flood-every", type=int, default=0, help="каждый N-й sendMessage — 429")
+    args = ap.parse_args()
+    fake = FakeTelegram(args.send_ms / 1000, args.flood_every)
+    print(f"fake telegram on http://{args.host}:{args.port}/bot<token>", flush=True)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# Общая настройка тестов: bot.py читает окружение при импорте, поэтому
+# выставляем его до первого `import bot` (как bench.py).
+import os, sys
+
+os.environ.setdefault("TELEGRAM_TOKEN", "0:test")
+os.environ.setdefault("CHAT_ID", "0")
+os.environ["STORE_PATH"] = ""   # без SQLite на диске
+os.environ["ROLE"] = "all"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
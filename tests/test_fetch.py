@@ -0,0 +1,220 @@
+# Повторы, таймауты, circuit breaker, устаревшие данные и hedging в _fetch_body /
+# _fetch_limited — против aiohttp-сервера в том же процессе. Сервер отвечает по
+# сценарию: каждый запрос берёт следующий шаг (код ошибки, задержка или 200).
+
+import time, asyncio, collections
+
+import aiohttp
+import orjson
+import pytest
+from aiohttp import web
+
+import bot as app
+
+class Scripted:
+    """Источник /src: шаги — int (HTTP-статус), float (задержка перед 200) или None (сразу 200)."""
+
+    def __init__(self, *steps, default=None):
+        self.steps = collections.deque(steps)
+        self.default = default
+        self.hits = 0
+
+    async def handle(self, request):
+        self.hits += 1
+        step = self.steps.popleft() if self.steps else self.default
+        if isinstance(step, int):
+            return web.Response(status=step, text="err")
+        if isinstance(step, float):
+            await asyncio.sleep(step)
+        return web.json_response({"hit": self.hits})
+
+async def timed(coro):
+    t = time.monotonic()
+    res = await coro
+    return res, time.monotonic() - t
+
+def run(src: Scripted, scenario):
+    """Поднимает сервер с src на свободном порту и выполняет scenario(session, url)."""
+    async def main():
+        server = web.Application()
+        server.router.add_get("/src", src.handle)
+        runner = web.AppRunner(server, shutdown_timeout=0.1)   # не ждать «зависших» обработчиков
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with app.http_session() as session:
+                return await scenario(session, f"http://127.0.0.1:{port}/src")
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+@pytest.fixture(autouse=True)
+def fetch_config(monkeypatch):
+    # быстрые таймауты и чистое состояние модуля на каждый тест
+    monkeypatch.setattr(app, "FETCH_ATTEMPT_TIMEOUT", 1.0)
+    monkeypatch.setattr(app, "FETCH_RETRIES", 2)
+    monkeypatch.setattr(app, "FETCH_BACKOFF", 0.01)
+    monkeypatch.setattr(app, "FETCH_HEDGE_MS", 0)
+    monkeypatch.setattr(app, "BREAKER_FAILS", 3)
+    monkeypatch.setattr(app, "BREAKER_COOLDOWN", 30)
+    monkeypatch.setattr(app, "REQUEST_TIMEOUT", 5)
+    monkeypatch.setattr(app, "_breakers", collections.defaultdict(app.CircuitBreaker))
+    monkeypatch.setattr(app, "_sources", {})
+    monkeypatch.setattr(app, "source_stats", dict.fromkeys(app.source_stats, 0))
+
+# ---------- retries ----------
+def test_retries_on_5xx():
+    src = Scripted(500, 503)
+    status, _, body = run(src, lambda s, url: app._fetch_body(s, url))
+    assert status == 200 and orjson.loads(body) == {"hit": 3}
+    assert src.hits == 3
+    assert app.source_stats["retried"] == 2
+
+def test_retries_on_attempt_timeout(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_ATTEMPT_TIMEOUT", 0.2)
+    src = Scripted(2.0)
+    status, _, _ = run(src, lambda s, url: app._fetch_body(s, url))
+    assert status == 200
+    assert src.hits == 2
+
+def test_no_retry_on_4xx():
+    src = Scripted(404, default=None)
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        run(src, lambda s, url: app._fetch_body(s, url))
+    assert e.value.status == 404
+    assert src.hits == 1
+    assert app.source_stats["retried"] == 0
+    assert not any(br.fails for br in app._breakers.values())   # 4xx — не недоступность
+
+def test_gives_up_after_retries():
+    src = Scripted(default=500)
+    with pytest.raises(aiohttp.ClientResponseError):
+        run(src, lambda s, url: app._fetch_body(s, url))
+    assert src.hits == 1 + app.FETCH_RETRIES
+
+def test_attempt_timeout_bounded_by_deadline(monkeypatch):
+    # попытка дольше общего дедлайна обрезается им, а не FETCH_ATTEMPT_TIMEOUT
+    monkeypatch.setattr(app, "FETCH_ATTEMPT_TIMEOUT", 10.0)
+    monkeypatch.setattr(app, "FETCH_RETRIES", 10)
+    monkeypatch.setattr(app, "REQUEST_TIMEOUT", 0.5)
+    src = Scripted(default=5.0)
+
+    async def scenario(s, url):
+        t = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await app._fetch_body(s, url)
+        assert time.monotonic() - t < app.REQUEST_TIMEOUT + 0.3
+
+    run(src, scenario)
+    assert src.hits == 1
+
+# ---------- circuit breaker ----------
+def test_breaker_opens_fails_fast_then_half_open(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_RETRIES", 0)
+    monkeypatch.setattr(app, "BREAKER_FAILS", 2)
+    monkeypatch.setattr(app, "BREAKER_COOLDOWN", 0.3)
+    src = Scripted(500, 500)
+
+    async def scenario(s, url):
+        for _ in range(app.BREAKER_FAILS):
+            with pytest.raises(aiohttp.ClientResponseError):
+                await app._fetch_body(s, url)
+        assert app._breakers[url].is_open()
+        with pytest.raises(app.CircuitOpen):
+            await app._fetch_body(s, url)
+        assert src.hits == app.BREAKER_FAILS   # отказ без запроса
+        assert app.source_stats["fail_fast"] == 1
+
+        await asyncio.sleep(app.BREAKER_COOLDOWN + 0.05)
+        # half-open: одна пробная загрузка, параллельная — сразу отказ
+        src.steps.append(0.2)
+        res = await asyncio.gather(app._fetch_body(s, url), app._fetch_body(s, url),
+                                   return_exceptions=True)
+        assert res[0][0] == 200
+        assert isinstance(res[1], app.CircuitOpen)
+        assert src.hits == app.BREAKER_FAILS + 1
+        assert not app._breakers[url].is_open()
+
+    run(src, scenario)
+
+def test_failed_trial_reopens_breaker(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_RETRIES", 0)
+    monkeypatch.setattr(app, "BREAKER_FAILS", 1)
+    monkeypatch.setattr(app, "BREAKER_COOLDOWN", 0.2)
+    src = Scripted(default=500)
+
+    async def scenario(s, url):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await app._fetch_body(s, url)
+        await asyncio.sleep(0.25)
+        with pytest.raises(aiohttp.ClientResponseError):
+            await app._fetch_body(s, url)   # пробная не удалась
+        with pytest.raises(app.CircuitOpen):
+            await app._fetch_body(s, url)
+        assert src.hits == 2
+
+    run(src, scenario)
+
+def test_cancelled_trial_allows_next_trial(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_RETRIES", 0)
+    monkeypatch.setattr(app, "BREAKER_FAILS", 1)
+    monkeypatch.setattr(app, "BREAKER_COOLDOWN", 0.2)
+    src = Scripted(500, 5.0)
+
+    async def scenario(s, url):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await app._fetch_body(s, url)
+        await asyncio.sleep(0.25)
+        trial = asyncio.ensure_future(app._fetch_body(s, url))
+        await asyncio.sleep(0.1)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        status, _, _ = await app._fetch_body(s, url)   # не CircuitOpen навсегда
+        assert status == 200
+        assert not app._breakers[url].is_open()
+
+    run(src, scenario)
+
+# ---------- stale fallback ----------
+def test_stale_parsed_data_on_error(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_RETRIES", 0)
+    src = Scripted(None, 500)
+
+    async def scenario(s, url):
+        name, first, err = await app._fetch_limited(s, "src", url, lambda d: d)
+        assert err is None and first == {"hit": 1}
+        name, parsed, err = await app._fetch_limited(s, "src", url, lambda d: d)
+        assert name == "src"
+        assert parsed is first
+        assert err.startswith("stale: ")
+        assert app.source_stats["stale"] == 1
+
+    run(src, scenario)
+
+def test_no_stale_without_previous_success(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_RETRIES", 0)
+    src = Scripted(default=500)
+    _, parsed, err = run(src, lambda s, url: app._fetch_limited(s, "src", url, lambda d: d))
+    assert parsed is None
+    assert err and not err.startswith("stale:")
+
+# ---------- hedging ----------
+def test_hedge_wins_over_slow_first_attempt(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_HEDGE_MS", 50)
+    monkeypatch.setattr(app, "FETCH_ATTEMPT_TIMEOUT", 5.0)
+    src = Scripted(3.0, None)
+    (status, _, body), took = run(src, lambda s, url: timed(app._fetch_body(s, url)))
+    assert took < 1.0
+    assert status == 200 and orjson.loads(body) == {"hit": 2}
+    assert app.source_stats["hedged"] == 1
+    assert app.source_stats["retried"] == 0
+
+def test_no_hedge_when_first_is_fast(monkeypatch):
+    monkeypatch.setattr(app, "FETCH_HEDGE_MS", 500)
+    src = Scripted(None)
+    run(src, lambda s, url: app._fetch_body(s, url))
+    assert src.hits == 1
+    assert app.source_stats["hedged"] == 0
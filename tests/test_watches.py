@@ -0,0 +1,87 @@
+# /watch: новые и исчезнувшие пулы — по реестрам, а не по отфильтрованной таблице.
+# Снапшоты собираются через merge_chain из синтетических ответов реестров.
+
+import pytest
+
+import bot as app
+
+CHAIN = "ethereum"
+MAIN, FACTORY = app.REGISTRIES[0], app.REGISTRIES[1]
+
+def pool(addr, tvl, name=None):
+    return app.PoolInfo(addr, name or addr, tvl, 0.0, None)
+
+class Feed:
+    """Ответы реестров по шагам; каждый шаг — новые dict'ы, как после разбора свежего ответа."""
+
+    def __init__(self, registry):
+        self.registry, self.prev = registry, None
+        self.volumes = {}
+
+    def step(self, by_reg):
+        by_reg = {reg: {p.address: p for p in pools} for reg, pools in by_reg.items()}
+        # объём есть у всех, иначе HIDE_ZERO спрятал бы пулы с нулевым APY
+        volumes = {a: 1e6 for pools in by_reg.values() for a in pools}
+        cur = app.merge_chain(CHAIN, volumes, {}, by_reg)
+        self.registry.on_snapshot(self.prev, cur)
+        self.prev = cur
+        return cur
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(app, "_merge_state", {})
+    monkeypatch.setattr(app, "MIN_TVL", 1e6)
+    monkeypatch.setattr(app, "HIDE_ZERO", True)
+    monkeypatch.setattr(app, "snapshots", app.SnapshotCache(60, 900))
+    reg = app.WatchRegistry(None, 0)
+    reg.fired = []
+    reg._fire = lambda w, line: reg.fired.append((w.id, line))
+    return reg
+
+def test_new_only_for_first_listing(registry):
+    w = registry.add(1, "new", CHAIN, 1e6)
+    feed = Feed(registry)
+    feed.step({MAIN: [pool("0xa", 5e6), pool("0xb", 2e5)]})
+    assert registry.fired == []   # первый ответ реестра — не «новые пулы»
+
+    feed.step({MAIN: [pool("0xa", 5e6), pool("0xb", 3e6)]})   # 0xb вошёл в таблицу по TVL
+    assert registry.fired == []
+
+    feed.step({MAIN: [pool("0xa", 5e5), pool("0xb", 3e6)]})   # 0xa выпал из таблицы
+    feed.step({MAIN: [pool("0xa", 5e6), pool("0xb", 3e6)]})   # и вернулся
+    assert registry.fired == []
+
+    feed.step({MAIN: [pool("0xa", 5e6), pool("0xb", 3e6), pool("0xc", 2e6, "fresh")]})
+    assert [(i, "fresh" in line) for i, line in registry.fired] == [(w.id, True)]
+
+def test_late_registry_is_not_new(registry):
+    registry.add(1, "new", CHAIN, 1e6)
+    feed = Feed(registry)
+    feed.step({MAIN: [pool("0xa", 5e6)]})
+    feed.step({MAIN: [pool("0xa", 5e6)], FACTORY: [pool("0xf1", 5e6), pool("0xf2", 5e6)]})
+    assert registry.fired == []
+    feed.step({MAIN: [pool("0xa", 5e6)], FACTORY: [pool("0xf1", 5e6), pool("0xf2", 5e6), pool("0xf3", 5e6)]})
+    assert len(registry.fired) == 1 and "0xf3" in registry.fired[0][1]
+
+def test_new_below_threshold_is_ignored(registry):
+    registry.add(1, "new", CHAIN, 10e6)
+    feed = Feed(registry)
+    feed.step({MAIN: [pool("0xa", 5e6)]})
+    feed.step({MAIN: [pool("0xa", 5e6), pool("0xb", 2e6)]})
+    assert registry.fired == []
+
+def test_removed_only_on_real_drop_or_delisting(registry):
+    w = registry.add(1, "tvl", CHAIN, 50, "0xa", "A", 1.5e6)
+    feed = Feed(registry)
+    feed.step({MAIN: [pool("0xa", 1.5e6), pool("0xb", 5e6)]})
+    feed.step({MAIN: [pool("0xa", 0.9e6), pool("0xb", 5e6)]})   # ниже MIN_TVL, но падение 40% < 50%
+    assert registry.fired == []
+
+    feed.step({MAIN: [pool("0xa", 1.5e6), pool("0xb", 5e6)]})
+    feed.step({MAIN: [pool("0xa", 0.5e6), pool("0xb", 5e6)]})   # −67%
+    assert len(registry.fired) == 1 and "−66.7%" in registry.fired[0][1]
+    assert w.baseline == 0.5e6
+
+    feed.step({MAIN: [pool("0xa", 1.5e6), pool("0xb", 5e6)]})
+    feed.step({MAIN: [pool("0xb", 5e6)]})                       # пропал из реестров
+    assert len(registry.fired) == 2 and "no longer listed" in registry.fired[1][1]